@@ -1,21 +1,50 @@
+import heapq
 import os
 import traceback
 import uuid
 from datetime import datetime, timedelta
+from itertools import islice
 
 import jwt
-import pandas as pd
 from dateutil import parser as dt_parser
 from flask import Flask, abort, g, jsonify, request
 from flask_cors import CORS
 from loguru import logger
-from sqlalchemy import and_, asc
+from sqlalchemy import delete, func, insert, select, update
 
 import src.constants as CONSTANTS
-from src.config import CONFIG_BY_ENV
+from src.config import CONFIG_BY_ENV, database_uri
+from src.services.admission import AdmissionController
+from src.services.bulk_create import BulkCreator, iter_json_array, iter_ndjson
 from src.services.db.enums import SealedStatus, TransferStatus
+from src.services.db.explain import explain, plan_indexes
+from src.services.db.filters import (
+    FilterError,
+    catalogue_filters,
+    filter_index,
+    filters_from_args,
+    normalize_enum_value,
+    pending_target_clause,
+)
+from src.services.db.group_commit import GroupCommitError, GroupCommitter
 from src.services.db.models import CatalogueItem, CatalogueArchiveItem, CatalogueTransferTracker, db
-from src.services.db.schema import CatalogueItemSchema, CatalogueTransferTrackerSchema
+from src.services.db.replicas import ReplicaRouter
+from src.services.db.shards import ShardRoutingError, current_shard, shard_router
+from src.services.db.schema import (
+    CatalogueItemSchema,
+    CatalogueTransferTrackerSchema,
+    CatalogueUploadManifestSchema,
+)
+from src.services.db.types import is_valid_id, normalize_id
+from src.services.ingest import IngestError, find_ingested_manifest, ingest_catalogue_file
+from src.services.parquet_archive import ParquetArchive
+from src.services.throughput import (
+    GRANULARITIES,
+    TERMINAL_STATUSES,
+    record_updates,
+    throughput_series,
+)
+from src.services.uploads import ChunkedUploads
 from src.utils import abort_json, clean_files, token_required
 
 ENV = os.getenv("FLASK_ENV", "local")
@@ -23,13 +52,7 @@ ENV = os.getenv("FLASK_ENV", "local")
 # TODO: Raise error if values not set
 CFG = CONFIG_BY_ENV[os.getenv("FLASK_ENV", "local")]
 
-DB_URI = f"{CFG.DB_TYPE}://{CFG.DB_USER}:{CFG.DB_PASSWORD}@{CFG.DB_HOST}:{CFG.DB_PORT}/{CFG.DB_NAME}"
-
-ERROR_MSG_ANY_OF_THE_CATALOGUE_POST_MANDATORY_FIELDS_EMPTY = (
-    "Any of the column "
-    + ",".join(CONSTANTS.CATALOGUE_POST_MANDATORY_FIELDS)
-    + "values are empty!"
-)
+DB_URI = database_uri(CFG)
 
 ALLOWED_EXTENSIONS = CFG.ALLOWED_EXTENSIONS
 
@@ -43,14 +66,74 @@ app.config["JWT_TOKEN_EXPIRATION_SECONDS"] = CFG.JWT_TOKEN_EXPIRATION_SECONDS
 
 CORS(app)
 
+admission = AdmissionController(
+    {
+        "heavy": dict(
+            concurrency=CFG.ADMISSION_HEAVY_CONCURRENCY,
+            queue_size=CFG.ADMISSION_HEAVY_QUEUE_SIZE,
+            wait_seconds=CFG.ADMISSION_WAIT_SECONDS,
+        ),
+        "list": dict(
+            concurrency=CFG.ADMISSION_LIST_CONCURRENCY,
+            queue_size=CFG.ADMISSION_LIST_QUEUE_SIZE,
+            wait_seconds=CFG.ADMISSION_WAIT_SECONDS,
+        ),
+        "upload": dict(
+            concurrency=CFG.ADMISSION_UPLOAD_CONCURRENCY,
+            queue_size=CFG.ADMISSION_UPLOAD_QUEUE_SIZE,
+            wait_seconds=CFG.ADMISSION_WAIT_SECONDS,
+        ),
+    },
+    retry_after_seconds=CFG.ADMISSION_RETRY_AFTER_SECONDS,
+    server_threads=CFG.GUNICORN_THREADS,
+)
+
+replica_router = ReplicaRouter(
+    db,
+    max_lag_seconds=CFG.DB_REPLICA_MAX_LAG_SECONDS,
+    lag_check_seconds=CFG.DB_REPLICA_LAG_CHECK_SECONDS,
+    read_your_writes_seconds=CFG.DB_READ_YOUR_WRITES_SECONDS,
+    connect_timeout_seconds=CFG.DB_REPLICA_CONNECT_TIMEOUT_SECONDS,
+)
+replica_router.init_app(app, CFG.DB_REPLICA_URIS)
+shard_router.init_app(
+    app, db, CFG.DB_SHARD_URIS, vnodes=CFG.DB_SHARD_VNODES, workers=CFG.DB_SHARD_WORKERS
+)
+
 db.init_app(app)
 with app.app_context():
     logger.info("Creating all tables...")
     db.create_all()
+    shard_router.create_all()
     logger.info("Created tables..")
 
 os.makedirs("tmp", exist_ok=True)
 
+chunked_uploads = ChunkedUploads(
+    CFG.UPLOAD_DIR,
+    max_chunk_bytes=CFG.UPLOAD_MAX_CHUNK_BYTES,
+    expiry_seconds=CFG.UPLOAD_EXPIRY_SECONDS,
+)
+
+group_committer = GroupCommitter(
+    db,
+    schemas={
+        CatalogueItem: CatalogueItemSchema(),
+        CatalogueTransferTracker: CatalogueTransferTrackerSchema(),
+    },
+    window_ms=CFG.GROUP_COMMIT_WINDOW_MS,
+    max_batch=CFG.GROUP_COMMIT_MAX_BATCH,
+    before_update=record_updates,
+)
+group_committer.init_app(app)
+
+parquet_archive = ParquetArchive(
+    CFG.ARCHIVE_PARQUET_URI,
+    compression=CFG.ARCHIVE_PARQUET_COMPRESSION,
+    file_rows=CFG.ARCHIVE_PARQUET_FILE_ROWS,
+    row_group_rows=CFG.ARCHIVE_PARQUET_ROW_GROUP_ROWS,
+)
+
 logger.info("Server up and running...")
 
 # TODO: Need to decide on the approach of single jwt token / individual jwt token based on user credentails
@@ -81,70 +164,157 @@ def get_catalogue(uuid: str):
     GET single item from the database
     """
     logger.info("/catalogue/<uuid> GET called")
-    res = CatalogueItem.query.filter_by(uuid=uuid).first()
+    if not is_valid_id(uuid):
+        abort_json(404, error="DATA_NOT_FOUND", message="Item not found!")
+    res = find_catalogue_item(CatalogueItem, uuid)
     if not res:
         abort_json(404, error="DATA_NOT_FOUND", message="Item not found!")
-    res = CatalogueItemSchema().dump(res)
     return jsonify(res)
 
 
+def find_catalogue_item(model, uuid: str):
+    """
+    Dumped item of `model` (looked up on every shard), None if it doesn't exist.
+    """
+
+    def find(shard):
+        item = model.query.filter_by(uuid=uuid).first()
+        return CatalogueItemSchema().dump(item) if item else None
+
+    return next((res for _, res in shard_router.scatter(find) if res), None)
+
+
+@app.route("/catalogue/lookup/", methods=["POST"])
+@replica_router.read_only
+#@token_required
+def lookup_catalogue():
+    """
+    This API is used to GET several CatalogueItems at once
+
+    The expected JSON input to request is of the form:
+        ..code-block:: json
+
+            {
+                "uuids": [<uuid1>, <uuid2>, ...],
+                "fields": ["transfer_status", "source_path"]
+            }
+    `fields` is optional (defaults to every field), `uuid` is always returned.
+    The items are returned by uuid (as sent), along with the uuids that don't exist:
+        ..code-block:: json
+
+            {
+                "items": {<uuid1>: {"uuid": <uuid1>, "transfer_status": "COMPLETED", "source_path": "..."}},
+                "missing": [<uuid2>]
+            }
+    """
+    logger.info("/catalogue/lookup/ POST called")
+    return lookup_response(CatalogueItem, CatalogueItemSchema)
+
+
+def lookup_response(model, schema_class):
+    """
+    Multi-get of `model` items with chunked `IN (...)` queries (on every shard
+    holding the model), selecting and dumping only the requested fields.
+    """
+    data = request.json or {}
+    if not isinstance(data, dict):
+        abort_json(400, error="LOOKUP_FAILED", message="Body should be a json object!")
+    uuids = data.get("uuids")
+    if not isinstance(uuids, list) or not all(isinstance(key, str) for key in uuids):
+        abort_json(400, error="LOOKUP_FAILED", message="uuids should be a list of uuids!")
+    if len(uuids) > CFG.LOOKUP_MAX_UUIDS:
+        abort_json(
+            400,
+            error="LOOKUP_FAILED",
+            message=f"At most {CFG.LOOKUP_MAX_UUIDS} uuids can be looked up at once!",
+        )
+    allowed = sorted(schema_class().fields)
+    fields = data.get("fields") or allowed
+    if (
+        not isinstance(fields, list)
+        or not all(isinstance(field, str) for field in fields)
+        or set(fields) - set(allowed)
+    ):
+        abort_json(
+            400,
+            error="LOOKUP_FAILED",
+            message=f"fields should be a list of {allowed}",
+        )
+    fields = list(dict.fromkeys(["uuid"] + fields))
+
+    # id as sent by the client -> canonical id
+    ids = {key: normalize_id(key) for key in uuids if is_valid_id(key)}
+    keys = list(dict.fromkeys(ids.values()))
+    columns = [model.__table__.c[field] for field in fields]
+
+    def fetch(shard):
+        res = []
+        for idx in range(0, len(keys), CFG.LOOKUP_CHUNK_SIZE):
+            chunk = keys[idx : idx + CFG.LOOKUP_CHUNK_SIZE]
+            rows = db.session.execute(select(*columns).where(model.uuid.in_(chunk))).all()
+            items = schema_class(many=True, only=fields).dump(rows)
+            res += [(row.uuid, item) for row, item in zip(rows, items)]
+        return res
+
+    found = {}
+    if keys:
+        for _, res in shard_router.scatter(fetch, shard_router.model_shards(model)):
+            found.update(res)
+    items = {key: found[uuid] for key, uuid in ids.items() if uuid in found}
+    missing = [key for key in dict.fromkeys(uuids) if key not in items]
+    logger.debug(f"Looked up {len(items)} items, {len(missing)} missing")
+
+    return jsonify(dict(items=items, missing=missing))
+
+
 @app.route("/catalogue/", methods=["GET"])
 #@token_required
+@admission.limit("list")
 def list_catalogue():
     """
     This API is used to select the CatalogueItem table based on query fitlers:
         - transfer_status (reference: `services.db.enums.TransferStatus`)
         - sealed_state (reference: `services.db.enums.SealedStatus`)
+        - source_storage_id, dest_storage_id
+        - ingestion_date_from/ingestion_date_to, content_date_start_from/content_date_start_to
+        - content_length_from/content_length_to
         - limit (to limit the number of records)
+        - explain (true to get the query plan instead of the records)
+    Equality filters accept comma separated values. Only the filter combinations
+    backed by an index are allowed (reference: `services.db.filters.FILTER_INDEXES`).
     """
     logger.info("/catalogue/ - GET called")
-    transfer_status = (
-        request.args.get("transfer_status", TransferStatus.NOT_STARTED.value)
-        .strip()
-        .upper()
-    )
-    sealed_status = (
-        request.args.get("sealed_state", SealedStatus.PERMANENT_UNSEALED.value)
-        .strip()
-        .upper()
-    )
-    
-    limit = request.args.get('limit')
-    if limit:
-        limit = int(limit)
-    else:
-        limit = int(CFG.LIMIT)
-
-    # page = 1
-    # try:
-    #     page = int(request.args.get("page", 1))
-    # except:
-    #     if app.config.get("DEBUG", False):
-    #         logger.warning("Defaulting page to 1")
-    #     page = 1
-
-    logger.debug(f"raw transfer_status = {request.args.get('transfer_status')}")
-    logger.debug(f"raw sealed_state = {request.args.get('sealed_state')}")
+    limit = query_limit()
 
+    filters, index = catalogue_query_filters()
     logger.debug(f"limit = {limit}")
-    logger.debug(f"status = {transfer_status}")
-    logger.debug(f"state = {sealed_status}")
-
-    res = CatalogueItem.query.filter(CatalogueItem.transfer_status == transfer_status and CatalogueItem.sealed_state == sealed_status).order_by(CatalogueItem.unseal_expiry_time.desc()).limit(limit).all()
-
-    # res = (
-    #     CatalogueItem.query.filter(
-    #         and_(
-    #             CatalogueItem.transfer_status == transfer_status,
-    #             CatalogueItem.sealed_state == sealed_status,
-    #         )
-    #     )
-    #     .order_by(asc(CatalogueItem.unseal_expiry_time))
-    #     .paginate(page=page, per_page=CFG.ITEMS_PER_PAGE, error_out=False)
-    # )
-    #res = CatalogueItemSchema(many=True).dump(res.items)
-    
-    res = CatalogueItemSchema(many=True).dump(res)
+    logger.debug(f"filters = {filters} (index={index})")
+
+    # explicit NULL ordering, the same on every database and for the merge below
+    # (postgresql's default for DESC, a backward scan of the expiry index)
+    order = CatalogueItem.unseal_expiry_time.desc().nulls_first()
+    shards = filter_shards(filters)
+    query = (
+        select(CatalogueItem)
+        .where(*catalogue_filters(filters))
+        .order_by(order)
+        .limit(limit)
+    )
+    if is_explain():
+        return explain_response(filters, index, query, shards)
+
+    def fetch(shard):
+        rows = db.session.execute(query).scalars().all()
+        items = CatalogueItemSchema(many=True).dump(rows)
+        return [(row.unseal_expiry_time, item) for row, item in zip(rows, items)]
+
+    # every shard returns its rows already sorted, only the top `limit` are kept
+    merged = heapq.merge(
+        *(rows for _, rows in shard_router.scatter(fetch, shards)),
+        key=lambda row: (row[0] is None, row[0] or datetime.min),
+        reverse=True,
+    )
+    res = [item for _, item in islice(merged, limit)]
     logger.debug(f"Total rows selected = {len(res)}")
 
     return jsonify(res)
@@ -152,30 +322,29 @@ def list_catalogue():
 
 @app.route("/catalogue/count/", methods=["GET"])
 #@token_required
+@admission.limit("list")
 def catalogue_count():
     """
-    This API is used to get the count of CatalogueItem table based on query fitlers:
+    This API is used to get the count of CatalogueItem table based on query fitlers
+    (same filters as `list_catalogue`):
         - transfer_status (reference: `services.db.enums.TransferStatus`)
         - sealed_state (reference: `services.db.enums.SealedStatus`)
     """
     logger.info("/catalogue/count/ - GET called")
-    status = (
-        request.args.get("transfer_status", TransferStatus.NOT_STARTED.value)
-        .strip()
-        .upper()
-    )
-    state = (
-        request.args.get("sealed_state", SealedStatus.PERMANENT_UNSEALED.value)
-        .strip()
-        .upper()
+    filters, index = catalogue_query_filters()
+    query = (
+        select(func.count()).select_from(CatalogueItem).where(*catalogue_filters(filters))
     )
+    shards = filter_shards(filters)
+    if is_explain():
+        return explain_response(filters, index, query, shards)
     try:
-        res = CatalogueItem.query.filter(
-            and_(
-                CatalogueItem.transfer_status == status,
-                CatalogueItem.sealed_state == state,
+        res = sum(
+            count
+            for _, count in shard_router.scatter(
+                lambda shard: db.session.execute(query).scalar(), shards
             )
-        ).count()
+        )
     except:
         abort_json(
             400,
@@ -185,6 +354,66 @@ def catalogue_count():
     return jsonify(dict(count=res))
 
 
+def query_limit() -> int:
+    """
+    `limit` query parameter (`LIMIT` if not set), a 400 if it isn't a positive integer.
+    """
+    limit = request.args.get("limit")
+    if not limit:
+        return int(CFG.LIMIT)
+    if not limit.strip().isdigit() or int(limit) < 1:
+        abort_json(400, error="FECTHING_FAILED", message=f"Invalid limit: {limit}")
+    return int(limit)
+
+
+def catalogue_query_filters():
+    """
+    Filters of the list/count endpoints from the query parameters along with
+    the index backing them. `transfer_status` and `sealed_state` default to
+    NOT_STARTED and PERMANENT_UNSEALED.
+    """
+    filters = filters_from_args(request.args)
+    filters.setdefault("transfer_status", [TransferStatus.NOT_STARTED.value])
+    filters.setdefault("sealed_state", [SealedStatus.PERMANENT_UNSEALED.value])
+    try:
+        index = filter_index(filters)
+    except FilterError as e:
+        abort_json(400, error="FECTHING_FAILED", message=str(e))
+    return filters, index
+
+
+def filter_shards(filters: dict) -> list:
+    """
+    Shards holding the items matching the filters (every shard without a
+    `source_storage_id` filter).
+    """
+    containers = filters.get("source_storage_id")
+    if isinstance(containers, str):
+        containers = [containers]
+    return shard_router.shards_for(containers)
+
+
+def is_explain() -> bool:
+    return request.args.get("explain", "").lower() == "true"
+
+
+def explain_response(filters: dict, index: str, query, shards: list):
+    """
+    Query plan and the indexes it actually uses (per shard when the query runs
+    on several shards), along with the index intended for the filters.
+    """
+    plans = shard_router.scatter(
+        lambda shard: explain(db.session, query, CatalogueItem), shards
+    )
+    if len(plans) == 1:
+        plan = plans[0][1]
+        indexes = plan_indexes(plan)
+    else:
+        plan = {shard: shard_plan for shard, shard_plan in plans}
+        indexes = {shard: plan_indexes(shard_plan) for shard, shard_plan in plans}
+    return jsonify(dict(filters=filters, intended_index=index, indexes=indexes, plan=plan))
+
+
 @app.route("/catalogue/", methods=["POST"])
 #@token_required
 def create_catalogue():
@@ -206,14 +435,17 @@ def create_catalogue():
     data["updated_on"] = data.get("updated_on", datetime.now())
     data["transfer_status"] = data.get("transfer_status", "NOT_STARTED").upper()
 
-    query = CatalogueItem.query.filter_by(uuid=data["uuid"]).first()
-    if query:
+    if not is_valid_id(data["uuid"]):
+        abort_json(400, error="INSERTION_FAILED", message="Invalid uuid!")
+    data["uuid"] = normalize_id(data["uuid"])
+    if shard_router.locate(CatalogueItem, [data["uuid"]]):
         abort_json(
             400,
             error="INSERTION_FAILED",
             message="uuid already exists!",
         )
 
+    shard_router.select(shard_router.shard_for(data["source_storage_id"]))
     try:
         item = CatalogueItem(**data)
         db.session.add(item)
@@ -237,14 +469,24 @@ def patch_catalogue(uuid: str):
     logger.info("/catalogue/<uuid> PATCH called")
     data = request.json
 
-    item = CatalogueItem.query.filter_by(uuid=uuid).first()
+    if not is_valid_id(uuid):
+        abort_json(404, error="PATCH_FAILED", message="uuid doesn't exist!")
+    try:
+        data = normalize_item_patch(data)
+    except FilterError as e:
+        abort_json(400, error="PATCH_FAILED", message=str(e))
+    if CFG.GROUP_COMMIT_ENABLED:
+        return group_commit_patch(CatalogueItem, uuid, data)
+    item = select_item_shard(CatalogueItem, uuid)
     if not item:
         abort_json(404, error="PATCH_FAILED", message="uuid doesn't exist!")
 
     try:
+        shard_router.check_update(CatalogueItem, current_shard(), data)
+    except ShardRoutingError as e:
+        abort_json(400, error="PATCH_FAILED", message=str(e))
 
-        if "transfer_status" in data:
-            data["transfer_status"] = data["transfer_status"].upper()
+    try:
         item.update(data)
     except:
         abort_json(
@@ -257,10 +499,55 @@ def patch_catalogue(uuid: str):
     return jsonify(CatalogueItemSchema().dump(item))
 
 
+def normalize_item_patch(data) -> dict:
+    """
+    Copy of a CatalogueItem patch with its enum values normalized, raises
+    `FilterError` for an invalid one (the compact schema can't store it).
+    """
+    if not isinstance(data, dict):
+        raise FilterError("Body should be a json object!")
+    data = dict(data)
+    for field in ("transfer_status", "sealed_state"):
+        if data.get(field) is not None:
+            data[field] = normalize_enum_value(field, data[field])
+    return data
+
+
+def group_commit_patch(model, uuid: str, data: dict):
+    """
+    PATCH through the group committer (`GROUP_COMMIT_ENABLED`), the response
+    is only sent once the batch holding the patch is committed.
+    """
+    data = dict(data or {})
+    if "transfer_status" in data:
+        try:
+            data["transfer_status"] = data["transfer_status"].upper()
+        except AttributeError:
+            abort_json(400, error="PATCH_FAILED", message="Invalid transfer_status!")
+    try:
+        return jsonify(group_committer.submit(model, uuid, data))
+    except GroupCommitError as e:
+        abort_json(e.status_code, error="PATCH_FAILED", message=e.message)
+
+
+def select_item_shard(model, uuid: str):
+    """
+    Select the shard holding the item for the rest of the request and return
+    the item, None if it doesn't exist.
+    """
+    routed = shard_router.route(model, [uuid])
+    if not routed:
+        return None
+    shard_router.select(next(iter(routed)))
+    return model.query.filter_by(uuid=uuid).first()
+
+
 @app.route("/catalogue/<uuid>/", methods=["DELETE"])
 #@token_required
 def delete_catalogue(uuid: str):
-    item = CatalogueItem.query.filter_by(uuid=uuid).first()
+    if not is_valid_id(uuid):
+        abort_json(404, error="DELETION_FAILED", message="uuid doesn't exist!")
+    item = select_item_shard(CatalogueItem, uuid)
     if not item:
         logger.error(f"Item for uuid={uuid} not found!")
         abort_json(404, error="DELETION_FAILED", message="uuid doesn't exist!")
@@ -271,9 +558,13 @@ def delete_catalogue(uuid: str):
     return jsonify(res)
 
 @app.route("/catalogue/", methods=["DELETE"])
+@admission.limit("heavy")
 def delete_all_catalogue():
-    db.session.query(CatalogueItem).delete()
-    db.session.commit()
+    def delete_shard(shard):
+        db.session.query(CatalogueItem).delete()
+        db.session.commit()
+
+    shard_router.scatter(delete_shard)
     return (
         jsonify(
             {
@@ -285,6 +576,7 @@ def delete_all_catalogue():
 
 @app.route("/catalogue/bulk/", methods=["PATCH"])
 #@token_required
+@admission.limit("heavy")
 def bulk_update_catalogue():
     """
     This API is used to bulk UPSERT the CatalogueItem values
@@ -305,16 +597,22 @@ def bulk_update_catalogue():
     """
     data = request.json
     failed, success = [], []
-    if data:
-        # this will only give the data that "exists" in the table
-        query = CatalogueItem.query.filter(CatalogueItem.uuid.in_(data.keys()))
-        for item in query:
-            try:
-                item.update(data.get(item.uuid, {}))
-                success.append(item.uuid)
-            except:
-                failed.append(item.uuid)
-    db.session.commit()
+    # canonical id -> id as sent by the client
+    ids = {normalize_id(key): key for key in data or {} if is_valid_id(key)}
+    # this will only give the data that "exists" in the table
+    for shard, shard_ids in shard_router.route(CatalogueItem, list(ids)).items():
+        with shard_router.use(shard):
+            query = CatalogueItem.query.filter(CatalogueItem.uuid.in_(shard_ids))
+            for item in query:
+                key = ids[item.uuid]
+                try:
+                    patch = normalize_item_patch(data.get(key, {}))
+                    shard_router.check_update(CatalogueItem, shard, patch)
+                    item.update(patch)
+                    success.append(key)
+                except:
+                    failed.append(key)
+            db.session.commit()
 
     # get all thoese keys that weren't updated in the db
     failed = list(set(data.keys()) - set(success))
@@ -323,8 +621,188 @@ def bulk_update_catalogue():
     return jsonify(dict(failed=failed, success=success))
 
 
+@app.route("/catalogue/bulk/json/", methods=["POST"])
+#@token_required
+@admission.limit("heavy")
+def bulk_create_catalogue():
+    """
+    This API is used to bulk create CatalogueItems from a streamed body, either:
+        - NDJSON (`Content-Type: application/x-ndjson`), one json record per line
+        - a JSON array of records (`Content-Type: application/json`)
+
+    Each record is validated like `POST /catalogue/` and the records are inserted
+    in batches of `BULK_CREATE_BATCH_SIZE`. Existing uuids are skipped, or
+    updated with `?on_conflict=update`.
+
+    The response holds the counts and the result of every record which wasn't
+    created (index in the body, uuid, status, error):
+        ..code-block:: json
+
+            {
+                "received": 3, "created": 1, "updated": 0, "skipped": 1, "failed": 1,
+                "results": [
+                    {"index": 1, "uuid": "<uuid>", "status": "skipped", "error": "uuid already exists"},
+                    {"index": 2, "uuid": null, "status": "failed", "error": "Missing ['source_path']"}
+                ],
+                "truncated": false
+            }
+    """
+    logger.info("/catalogue/bulk/json/ POST called")
+    ndjson = request.mimetype in ("application/x-ndjson", "application/jsonl")
+    parse = iter_ndjson if ndjson else iter_json_array
+    try:
+        creator = BulkCreator(
+            on_conflict=request.args.get("on_conflict", "skip"),
+            batch_size=CFG.BULK_CREATE_BATCH_SIZE,
+            max_results=CFG.BULK_CREATE_MAX_RESULTS,
+        )
+    except IngestError as e:
+        abort_json(e.status_code, error=e.error, message=e.message)
+    try:
+        res = creator.run(parse(request.stream, CFG.BULK_CREATE_MAX_RECORD_BYTES))
+    except IngestError as e:
+        # batches before the malformed part of the body are already committed
+        res = creator.summary()
+        logger.error(f"Bulk create stopped: {e.message}")
+        return jsonify(dict(res, error=e.error, message=e.message)), e.status_code
+    logger.debug(f"Bulk create: {dict(res, results=len(res['results']))}")
+    return jsonify(res)
+
+
+@app.route("/catalogue/transition/", methods=["POST"])
+#@token_required
+@admission.limit("heavy")
+def transition_catalogue():
+    """
+    This API is used to move every CatalogueItem matching a filter to a target state
+    with chunked set-based UPDATEs (no uuids are sent over the wire).
+
+    The expected JSON input to request is of the form:
+        ..code-block:: json
+
+            {
+                "filter": {
+                    "source_storage_id": "<container>" | [<container>, ...],
+                    "dest_storage_id": "<container>" | [<container>, ...],
+                    "transfer_status": "FAILED" | [...],
+                    "sealed_state": "SEALED" | [...],
+                    "ingestion_date": {"from": <datetime>, "to": <datetime>},
+                    "content_date_start": {"from": <datetime>, "to": <datetime>}
+                },
+                "target": {"transfer_status": "NOT_STARTED", "sealed_state": <state>},
+                "dry_run": false,
+                "chunk_size": 10000
+            }
+    Rows already in the target state are left untouched. With `dry_run`, only the
+    number of rows that would change is returned.
+    """
+    logger.info("/catalogue/transition/ POST called")
+    data = request.json or {}
+    if not isinstance(data, dict):
+        abort_json(400, error="TRANSITION_FAILED", message="Body should be a json object!")
+
+    filters = data.get("filter") or {}
+    target = data.get("target") or {}
+    dry_run = data.get("dry_run", False)
+    if not filters:
+        abort_json(400, error="TRANSITION_FAILED", message="Empty filter!")
+    if not isinstance(dry_run, bool):
+        abort_json(400, error="TRANSITION_FAILED", message="dry_run should be a boolean!")
+    if (
+        not isinstance(target, dict)
+        or not target
+        or set(target) - {"transfer_status", "sealed_state"}
+    ):
+        abort_json(
+            400,
+            error="TRANSITION_FAILED",
+            message="target should only have transfer_status and/or sealed_state!",
+        )
+    try:
+        clauses = catalogue_filters(filters)
+        target = {k: normalize_enum_value(k, v) for k, v in target.items()}
+        chunk_size = transition_chunk_size(data.get("chunk_size"))
+    except FilterError as e:
+        abort_json(400, error="TRANSITION_FAILED", message=str(e))
+    clauses.append(pending_target_clause(target))
+
+    shards = filter_shards(filters)
+    if dry_run:
+        counts = shard_router.scatter(
+            lambda shard: db.session.execute(
+                select(func.count()).select_from(CatalogueItem).where(*clauses)
+            ).scalar(),
+            shards,
+        )
+        return jsonify(dict(dry_run=True, count=sum(count for _, count in counts)))
+
+    # items reaching COMPLETED/FAILED are added to the throughput rollups
+    rolls_up = target.get("transfer_status") in TERMINAL_STATUSES
+    progress = {}
+
+    def transition(shard):
+        total, chunks = 0, 0
+        while True:
+            chunk = select(CatalogueItem.uuid).where(*clauses).limit(chunk_size)
+            if rolls_up:
+                uuids = db.session.execute(chunk).scalars().all()
+                record_updates(db.session, CatalogueItem, dict.fromkeys(uuids, target))
+                chunk = uuids
+            else:
+                chunk = chunk.scalar_subquery()
+            res = db.session.execute(
+                update(CatalogueItem)
+                .where(CatalogueItem.uuid.in_(chunk))
+                .values(**target, updated_on=datetime.now())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            total += res.rowcount
+            chunks += 1
+            progress[shard] = total
+            if res.rowcount < chunk_size:
+                return total, chunks
+
+    try:
+        res = shard_router.scatter(transition, shards)
+        total = sum(total for _, (total, _) in res)
+        chunks = sum(chunks for _, (_, chunks) in res)
+    except:
+        db.session.rollback()
+        logger.error(traceback.format_exc())
+        abort_json(
+            400,
+            error="TRANSITION_FAILED",
+            message=f"Transition failed after updating {sum(progress.values())} items.",
+        )
+    logger.debug(f"Transitioned {total} items in {chunks} chunk(s) to {target}")
+
+    return jsonify(dict(dry_run=False, count=total, chunks=chunks))
+
+
+def transition_chunk_size(value) -> int:
+    """
+    `chunk_size` of a transition (an integer or a string of digits),
+    `TRANSITION_CHUNK_SIZE` if not set.
+    """
+    if value is None:
+        return CFG.TRANSITION_CHUNK_SIZE
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if (
+        isinstance(value, bool)
+        or not isinstance(value, int)
+        or not 1 <= value <= CFG.TRANSITION_MAX_CHUNK_SIZE
+    ):
+        raise FilterError(
+            f"chunk_size should be an integer between 1 and {CFG.TRANSITION_MAX_CHUNK_SIZE}"
+        )
+    return value
+
+
 @app.route("/catalogue/bulk/csv/", methods=["POST"])
 #@token_required
+@admission.limit("heavy")
 def upload_csv():
     """
     Endpoint to upload CSV/ZIP and update catalogeitem table
@@ -346,7 +824,7 @@ def upload_csv():
     """
     logger.info("/catalogue/upload/ POST called")
     file = request.files["file"]
-    fextension = file.filename.rsplit('.', 1)[1].lower()
+    fextension = file_extension(file.filename)
     if fextension not in ALLOWED_EXTENSIONS:
         abort_json(400, error="INVALID_FILE_EXTENSION")
     fname = uuid.uuid4().hex
@@ -360,115 +838,185 @@ def upload_csv():
     file.save(fpath)
 
     try:
-        data = pd.read_csv(fpath)
-    except:
-        logger.error("Failed to load csv")
-        clean_files([fpath])
-        abort_json(400, error="INVALID_FILE")
-
-    try:
-        data.rename(
-            columns=CONSTANTS.CATALOGUE_CSV_COLUMN_MAPPER, inplace=True, errors="raise"
+        res = ingest_catalogue_file(
+            fpath, file.filename, force=request.args.get("force", "").lower() == "true"
         )
-    except:
-        logger.error("Some columns are missing or improper column name.")
+    except IngestError as e:
+        abort_json(e.status_code, error=e.error, message=e.message)
+    finally:
         clean_files([fpath])
-        abort_json(
-            400,
-            error="UPLOAD_FAILED",
-            message="Invalid columns or some columns are missing!",
-        )
+    logger.info("CatalogueItem table updated Successfully!")
+    return ingest_response(res)
 
-    # make sure these columns aren't empty
-    if data[CONSTANTS.CATALOGUE_POST_MANDATORY_FIELDS].isna().sum().sum() > 0:
-        logger.error(ERROR_MSG_ANY_OF_THE_CATALOGUE_POST_MANDATORY_FIELDS_EMPTY)
-        clean_files([fpath])
-        abort_json(
-            400,
-            error="UPLOAD_FAILED",
-            message=ERROR_MSG_ANY_OF_THE_CATALOGUE_POST_MANDATORY_FIELDS_EMPTY,
-        )
 
-    # in case content end date is missing, fill it up with start date
-    data["content_date_end"].fillna(data["content_date_start"], inplace=True)
-    try:
-        data["content_date_start"] = pd.to_datetime(data["content_date_start"])
-        data["content_date_end"] = pd.to_datetime(data["content_date_end"])
-        data["ingestion_date"] = pd.to_datetime(data["ingestion_date"])
-        # data["ingestion_date"] = data["ingestion_date"].apply(dt_parser.parse)
-    except:
-        logger.error(
-            "Date time conversion failed for content_date_start and content_date_end columns! Aborting..."
-        )
-        clean_files([fpath])
-        abort_json(
-            400, error="UPLOAD_FAILED", message="Invalid ingestion/content-start date!"
-        )
+def file_extension(filename: str) -> str:
+    return filename.rsplit(".", 1)[1].lower() if "." in filename else ""
 
-    # add transfer columns
-    data["transfer_id"] = ""
-    data["transfer_status"] = "NOT_STARTED"
-    data["transfer_checksum_value"] = ""
-    data["transfer_checksum_verification"] = ""
-    data["transfer_started_on"] = CONSTANTS.DATETIME_OLDEST
-    data["transfer_completed_on"] = CONSTANTS.DATETIME_OLDEST
-    data["transfer_source"] = ""
-    data["transfer_destination"] = ""
-
-    data["sealed_state"] = data["sealed_state"].map(
-        CONSTANTS.CATALOGUE_SEALED_STATE_MAPPER
-    )
 
-    data["created_on"] = datetime.now()
-    data["updated_on"] = datetime.now()
+def ingest_response(res: dict):
+    body = {
+        "message": "success",
+        "failed": {"count": len(res["failed"]), "uuids": res["failed"]},
+        "duplicate": res["duplicate"],
+        "manifest": res["manifest"],
+    }
+    if "members" in res:
+        body["members"] = res["members"]
+    return jsonify(body), 200
 
-    uuids = list(data["uuid"])
-    items = list(map(lambda d: CatalogueItem(**d), data.to_dict("records")))
 
-    logger.debug(f"Dumping to table={CatalogueItem.__tablename__}")
+@app.route("/catalogue/bulk/csv/uploads/", methods=["POST"])
+#@token_required
+def initiate_upload():
+    """
+    Start a resumable chunked upload of a CSV/ZIP manifest (see `upload_csv` for the format).
 
-    failed = []
-    try:
+    The expected JSON input to request is of the form:
+        ..code-block:: json
 
-        existing_data = CatalogueItem.query.filter(CatalogueItem.uuid.in_(uuids))
-        existing_uuids = set(map(lambda d: d.uuid, existing_data))
+            {
+                "filename": "manifest.csv",
+                "content_hash": <optional sha256 hex digest of the whole file>
+            }
+    If a manifest with the same `content_hash` was already ingested, nothing needs
+    to be uploaded and `duplicate` is returned as true.
+    """
+    logger.info("/catalogue/bulk/csv/uploads/ POST called")
+    data = request.json or {}
+    filename = data.get("filename") or ""
+    fextension = file_extension(filename)
+    if not fextension or fextension not in ALLOWED_EXTENSIONS:
+        abort_json(400, error="INVALID_FILE_EXTENSION")
 
-        to_add_uuids = set(uuids) - existing_uuids
-        to_add_data = list(filter(lambda item: item.uuid in to_add_uuids, items))
-        db.session.add_all(to_add_data)
-        db.session.commit()
+    content_hash = (data.get("content_hash") or "").lower()
+    manifest = find_ingested_manifest(content_hash) if content_hash else None
+    if manifest and not data.get("force", False):
+        return jsonify(
+            dict(duplicate=True, manifest=CatalogueUploadManifestSchema().dump(manifest))
+        )
 
-        failed = list(existing_uuids)
-        logger.debug(f"{len(to_add_data)}/{len(uuids)} data added.")
-    except:
-        logger.error("CatalogueItem table upload failed")
-        abort_json(400, error="UPLOAD_FAILED", message="Dumping to sql table failed!")
-    finally:
-        clean_files([fpath])
-    logger.info("CatalogueItem table updated Successfully!")
+    upload_id = chunked_uploads.initiate(filename, fextension)
     return (
         jsonify(
-            {
-                "message": "success",
-                "failed": {"count": len(failed), "uuids": failed},
-            }
+            dict(
+                duplicate=False,
+                upload_id=upload_id,
+                max_chunk_bytes=CFG.UPLOAD_MAX_CHUNK_BYTES,
+            )
         ),
-        200,
+        201,
     )
 
+
+@app.route("/catalogue/bulk/csv/uploads/<upload_id>/", methods=["GET"])
+#@token_required
+def get_upload(upload_id: str):
+    """
+    GET the received chunk numbers of an upload, used to resume it
+    """
+    try:
+        meta = chunked_uploads.meta(upload_id)
+        chunks = chunked_uploads.chunks(upload_id)
+    except IngestError as e:
+        abort_json(e.status_code, error=e.error, message=e.message)
+    return jsonify(dict(upload_id=upload_id, filename=meta["filename"], chunks=chunks))
+
+
+@app.route("/catalogue/bulk/csv/uploads/<upload_id>/", methods=["DELETE"])
+#@token_required
+def delete_upload(upload_id: str):
+    try:
+        chunked_uploads.meta(upload_id)
+    except IngestError as e:
+        abort_json(e.status_code, error=e.error, message=e.message)
+    chunked_uploads.discard(upload_id)
+    return jsonify(dict(upload_id=upload_id))
+
+
+@app.route(
+    "/catalogue/bulk/csv/uploads/<upload_id>/chunks/<int:number>/", methods=["PUT"]
+)
+#@token_required
+@admission.limit("upload")
+def put_upload_chunk(upload_id: str, number: int):
+    """
+    Upload a single chunk (raw body) of an upload. Chunks are numbered from 1.
+    The optional `X-Chunk-Sha256` header is used to verify the chunk.
+    """
+    logger.info("/catalogue/bulk/csv/uploads/<upload_id>/chunks/<number>/ PUT called")
+    try:
+        res = chunked_uploads.write_chunk(
+            upload_id, number, request.stream, request.headers.get("X-Chunk-Sha256")
+        )
+    except IngestError as e:
+        abort_json(e.status_code, error=e.error, message=e.message)
+    return jsonify(res)
+
+
+@app.route("/catalogue/bulk/csv/uploads/<upload_id>/finalize/", methods=["POST"])
+#@token_required
+@admission.limit("heavy")
+def finalize_upload(upload_id: str):
+    """
+    Assemble the chunks and ingest the manifest (skipped if a manifest with the
+    same content was already ingested, unless `force` is set).
+
+    The expected JSON input to request is of the form:
+        ..code-block:: json
+
+            {"total_chunks": 12, "force": false}
+    """
+    logger.info("/catalogue/bulk/csv/uploads/<upload_id>/finalize/ POST called")
+    data = request.json or {}
+    try:
+        meta = chunked_uploads.meta(upload_id)
+        total_chunks = data.get("total_chunks") or len(chunked_uploads.chunks(upload_id))
+        if isinstance(total_chunks, str) and total_chunks.strip().isdigit():
+            total_chunks = int(total_chunks)
+        if isinstance(total_chunks, bool) or not isinstance(total_chunks, int):
+            raise IngestError("INVALID_CHUNK", "total_chunks should be an integer!")
+        fpath, content_hash, size = chunked_uploads.assemble(upload_id, total_chunks)
+        logger.debug(f"Assembled upload={upload_id} size={size} sha256={content_hash}")
+        res = ingest_catalogue_file(
+            fpath,
+            meta["filename"],
+            upload_id=upload_id,
+            force=data.get("force", False),
+            content_hash=content_hash,
+            size=size,
+        )
+    except IngestError as e:
+        abort_json(e.status_code, error=e.error, message=e.message)
+    chunked_uploads.discard(upload_id)
+    logger.info("CatalogueItem table updated Successfully!")
+    return ingest_response(res)
+
+
 @app.route("/catalogue/archive/records/", methods=["POST"])
+@admission.limit("heavy")
 def archive_catalogue_records():
     logger.info("/catalogue/archive/records/ POST called")
     container_name = (request.args.get("container_name"))
     if not container_name or not container_name.strip():
        return abort_json(400, error="REQUEST_FAILED", message="Please enter container name!")
+    # the live and archived items of a container are on the same shard
+    shard_router.select(shard_router.shard_for(container_name))
     try:
-        query = "INSERT INTO {} SELECT * FROM {} WHERE source_storage_id='{}';".format(CatalogueArchiveItem.__tablename__, CatalogueItem.__tablename__, container_name)
+        # column types (compact schema) are applied through the bound parameters
+        columns = [column.name for column in CatalogueItem.__table__.columns]
+        query = insert(CatalogueArchiveItem).from_select(
+            columns,
+            select(*CatalogueItem.__table__.columns).where(
+                CatalogueItem.source_storage_id == container_name
+            ),
+        )
         logger.info(f"archiving query: {query}")
         db.session.execute(query)
-        query = "DELETE FROM {} WHERE source_storage_id='{}';".format(CatalogueItem.__tablename__, container_name)
+        query = delete(CatalogueItem).where(
+            CatalogueItem.source_storage_id == container_name
+        )
         logger.info(f"delete query: {query}")
-        db.session.execute(query)
+        db.session.execute(query, execution_options={"synchronize_session": False})
         db.session.commit()
     except:
         logger.error("Archiving the records to archive table got failed")
@@ -484,6 +1032,142 @@ def archive_catalogue_records():
     )
 
 
+@app.route("/catalogue/archive/offload/", methods=["POST"])
+@admission.limit("heavy")
+def offload_archive_records():
+    """
+    Offload archived items to the parquet cold tier and delete them from the
+    archive table. Offloads every archived container if `container_name` isn't set.
+    """
+    logger.info("/catalogue/archive/offload/ POST called")
+    container_name = request.args.get("container_name", "").strip()
+    containers = [container_name] if container_name else parquet_archive.archived_containers()
+    res = {}
+    try:
+        for container in containers:
+            res[container] = parquet_archive.offload(container)
+    except:
+        logger.error(traceback.format_exc())
+        abort_json(
+            400,
+            error="OFFLOAD_FAILED",
+            message=f"Offloading archived items failed after {len(res)} container(s)!",
+        )
+    return jsonify(res)
+
+
+@app.route("/catalogue/archive/lookup/<uuid>/", methods=["GET"])
+def lookup_archive_catalogue(uuid: str):
+    """
+    GET single item from the live, archive or parquet tiers (in that order).
+    The tier is returned in the `tier` field.
+    """
+    logger.info("/catalogue/archive/lookup/<uuid>/ GET called")
+    if not is_valid_id(uuid):
+        abort_json(404, error="DATA_NOT_FOUND", message="Item not found!")
+    for tier, model in (("live", CatalogueItem), ("archive", CatalogueArchiveItem)):
+        res = find_catalogue_item(model, uuid)
+        if res:
+            return jsonify(dict(res, tier=tier))
+    res = parquet_archive.lookup(uuid)
+    if not res:
+        abort_json(404, error="DATA_NOT_FOUND", message="Item not found!")
+    return jsonify(dict(CatalogueItemSchema().dump(res), tier="parquet"))
+
+
+@app.route("/catalogue/archive/search/", methods=["GET"])
+@admission.limit("list")
+def search_archive_catalogue():
+    """
+    This API is used to search the live, archive and parquet tiers (in that order)
+    based on query filters:
+        - source_storage_id, dest_storage_id, transfer_status, sealed_state
+          (comma separated values)
+        - ingestion_date_from/ingestion_date_to, content_date_start_from/content_date_start_to
+        - limit (to limit the number of records)
+    Each record has its tier in the `tier` field.
+    """
+    logger.info("/catalogue/archive/search/ GET called")
+    limit = query_limit()
+    filters = filters_from_args(request.args)
+
+    res = []
+    try:
+        shards = filter_shards(filters)
+        for tier, model in (("live", CatalogueItem), ("archive", CatalogueArchiveItem)):
+            clauses, remaining = catalogue_filters(filters, model), limit - len(res)
+
+            def search(shard):
+                rows = model.query.filter(*clauses).limit(remaining).all()
+                return CatalogueItemSchema(many=True).dump(rows)
+
+            for _, rows in shard_router.scatter(search, shards):
+                res += [dict(row, tier=tier) for row in rows[: limit - len(res)]]
+        rows = parquet_archive.search(filters, limit - len(res))
+        res += [dict(row, tier="parquet") for row in CatalogueItemSchema(many=True).dump(rows)]
+    except FilterError as e:
+        abort_json(400, error="FECTHING_FAILED", message=str(e))
+    logger.debug(f"Total rows selected = {len(res)}")
+
+    return jsonify(res)
+
+
+@app.route("/catalogue/stats/throughput/", methods=["GET"])
+#@token_required
+@admission.limit("list")
+def throughput_stats():
+    """
+    Transfer throughput series (from the rollups) based on query params:
+        - granularity: minute/hour (default: hour)
+        - from, to: time range (default: the last 24 hours)
+        - source_storage_id, dest_storage_id: comma separated values
+        - transfer_status: COMPLETED and/or FAILED (default: both)
+        - percentiles: comma separated duration percentiles (default: 50,90,99)
+    Every series (storage pair and status) holds per bucket the files, bytes,
+    bytes per second and the transfer duration mean and percentiles in ms.
+    """
+    logger.info("/catalogue/stats/throughput/ GET called")
+    granularity = request.args.get("granularity", "hour")
+    if granularity not in GRANULARITIES:
+        abort_json(
+            400,
+            error="FECTHING_FAILED",
+            message=f"granularity should be one of {list(GRANULARITIES)}",
+        )
+    try:
+        end = dt_parser.parse(request.args["to"]) if request.args.get("to") else datetime.now()
+        start = (
+            dt_parser.parse(request.args["from"])
+            if request.args.get("from")
+            else end - timedelta(days=1)
+        )
+        percentiles = [
+            float(pct) for pct in request.args.get("percentiles", "50,90,99").split(",")
+        ]
+        filters = {
+            field: [
+                normalize_enum_value(field, v) if field == "transfer_status" else v
+                for v in request.args[field].split(",")
+            ]
+            for field in ("source_storage_id", "dest_storage_id", "transfer_status")
+            if request.args.get(field)
+        }
+    except (ValueError, OverflowError) as e:
+        abort_json(400, error="FECTHING_FAILED", message=f"Invalid query params: {e}")
+    if any(not 0 <= pct <= 100 for pct in percentiles):
+        abort_json(400, error="FECTHING_FAILED", message="Percentiles should be in [0, 100]")
+
+    series = throughput_series(db.session, granularity, start, end, filters, percentiles)
+    return jsonify(
+        dict(
+            granularity=granularity,
+            start=start.isoformat(),
+            end=end.isoformat(),
+            series=series,
+        )
+    )
+
+
 @app.route("/catalogue/transfer/", methods=["POST"])
 #@token_required
 def create_catalogue_transfer():
@@ -498,6 +1182,9 @@ def create_catalogue_transfer():
     data["updated_on"] = data.get("updated_on", datetime.now())
     data["transfer_status"] = data.get("transfer_status", "NOT_STARTED").upper()
 
+    if not is_valid_id(data["uuid"]):
+        abort_json(400, error="INSERTION_FAILED", message="Invalid uuid!")
+    data["uuid"] = normalize_id(data["uuid"])
     query = CatalogueTransferTracker.query.filter_by(uuid=data["uuid"]).first()
     if query:
         abort_json(
@@ -520,6 +1207,7 @@ def create_catalogue_transfer():
     return jsonify(data)
 
 @app.route("/catalogue/transfer/", methods=["GET"])
+@admission.limit("list")
 def list_catalogue_transfer():
     """
     Endpoint to list the transfers
@@ -533,6 +1221,18 @@ def list_catalogue_transfer():
 
     return jsonify(res)
 
+@app.route("/catalogue/transfer/lookup/", methods=["POST"])
+@replica_router.read_only
+#@token_required
+def lookup_catalogue_transfer():
+    """
+    This API is used to GET several CatalogueTransferTrackers at once,
+    same request and response as `lookup_catalogue`.
+    """
+    logger.info("/catalogue/transfer/lookup/ POST called")
+    return lookup_response(CatalogueTransferTracker, CatalogueTransferTrackerSchema)
+
+
 @app.route("/catalogue/transfer/uuid/<uuid>/", methods=["GET"])
 #@token_required
 def get_catalogue_transfer(uuid: str):
@@ -540,6 +1240,8 @@ def get_catalogue_transfer(uuid: str):
     GET single catalogue transfer item from the database
     """
     logger.info("/catalogue/transfer/uuid/<uuid>/ GET called")
+    if not is_valid_id(uuid):
+        abort_json(404, error="DATA_NOT_FOUND", message="Item not found!")
     res = CatalogueTransferTracker.query.filter_by(uuid=uuid).first()
     if not res:
         abort_json(404, error="DATA_NOT_FOUND", message="Item not found!")
@@ -555,6 +1257,10 @@ def patch_catalogue_transfer(uuid: str):
     logger.info("/catalogue/transfer/uuid/<uuid>/ PATCH called")
     data = request.json
 
+    if not is_valid_id(uuid):
+        abort_json(404, error="PATCH_FAILED", message="uuid doesn't exist!")
+    if CFG.GROUP_COMMIT_ENABLED:
+        return group_commit_patch(CatalogueTransferTracker, uuid, data)
     item = CatalogueTransferTracker.query.filter_by(uuid=uuid).first()
     if not item:
         abort_json(404, error="PATCH_FAILED", message="uuid doesn't exist!")
@@ -572,6 +1278,14 @@ def patch_catalogue_transfer(uuid: str):
     db.session.commit()
     return jsonify(CatalogueTransferTrackerSchema().dump(item))
 
+@app.route("/admission/metrics/", methods=["GET"])
+def admission_metrics():
+    """
+    In flight/waiting requests and rejections per limited endpoint class.
+    """
+    return jsonify(admission.metrics())
+
+
 @app.route("/health/", methods=["GET"])
 def health():
     return "Catalogue server v1 api!"
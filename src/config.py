@@ -14,6 +14,62 @@ class BaseConfig:
     JWT_TOKEN_EXPIRATION_SECONDS = int(os.getenv("JWT_TOKEN_EXPIRATION_SECONDS", 300))
     DEBUG = os.getenv("FLASK_DEBUG", False)
     ALLOWED_EXTENSIONS = os.getenv("ALLOWED_EXTENSIONS", "{'csv', 'zip'}")
+    # store ids as native uuid and dictionary-encode statuses/storage ids
+    DB_COMPACT_SCHEMA = os.getenv("DB_COMPACT_SCHEMA", "false").lower() in ("1", "true", "yes")
+    TRANSITION_CHUNK_SIZE = int(os.getenv("TRANSITION_CHUNK_SIZE", 10000))
+    TRANSITION_MAX_CHUNK_SIZE = int(os.getenv("TRANSITION_MAX_CHUNK_SIZE", 100000))
+    # local directory or object store uri (eg: s3://bucket/prefix) for offloaded archive items
+    ARCHIVE_PARQUET_URI = os.getenv("ARCHIVE_PARQUET_URI", "archive")
+    ARCHIVE_PARQUET_COMPRESSION = os.getenv("ARCHIVE_PARQUET_COMPRESSION", "zstd")
+    ARCHIVE_PARQUET_FILE_ROWS = int(os.getenv("ARCHIVE_PARQUET_FILE_ROWS", 1000000))
+    ARCHIVE_PARQUET_ROW_GROUP_ROWS = int(os.getenv("ARCHIVE_PARQUET_ROW_GROUP_ROWS", 100000))
+    # processes parsing the csv members of an uploaded zip
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+    # a manifest INGESTING for longer is considered failed (eg: the server died)
+    INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", 6 * 60 * 60))
+    UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join("tmp", "uploads"))
+    # keep chunks below nginx client_max_body_size
+    UPLOAD_MAX_CHUNK_BYTES = int(os.getenv("UPLOAD_MAX_CHUNK_BYTES", 64 * 1024 * 1024))
+    UPLOAD_EXPIRY_SECONDS = int(os.getenv("UPLOAD_EXPIRY_SECONDS", 24 * 60 * 60))
+    # full sqlalchemy uri, overrides the DB_* values above (eg: sqlite for local runs)
+    DB_URI = os.getenv("DB_URI")
+    # comma separated sqlalchemy uris of the read replicas used by GET endpoints
+    DB_REPLICA_URIS = [
+        uri.strip() for uri in os.getenv("DB_REPLICA_URIS", "").split(",") if uri.strip()
+    ]
+    DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", 5))
+    DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", 2))
+    DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", 10))
+    DB_REPLICA_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DB_REPLICA_CONNECT_TIMEOUT_SECONDS", 2))
+    # coalesce concurrent single item PATCHes into one commit per window
+    GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+    GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", 5))
+    GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", 500))
+    # concurrency limits and wait queues per endpoint class (0 concurrency: unlimited)
+    # the concurrency + queue size of every class should stay below the server threads
+    # (GUNICORN_THREADS), so single item requests always have a free thread
+    GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", 8))
+    ADMISSION_HEAVY_CONCURRENCY = int(os.getenv("ADMISSION_HEAVY_CONCURRENCY", 1))
+    ADMISSION_HEAVY_QUEUE_SIZE = int(os.getenv("ADMISSION_HEAVY_QUEUE_SIZE", 1))
+    ADMISSION_LIST_CONCURRENCY = int(os.getenv("ADMISSION_LIST_CONCURRENCY", 2))
+    ADMISSION_LIST_QUEUE_SIZE = int(os.getenv("ADMISSION_LIST_QUEUE_SIZE", 1))
+    ADMISSION_UPLOAD_CONCURRENCY = int(os.getenv("ADMISSION_UPLOAD_CONCURRENCY", 1))
+    ADMISSION_UPLOAD_QUEUE_SIZE = int(os.getenv("ADMISSION_UPLOAD_QUEUE_SIZE", 0))
+    ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", 10))
+    ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 5))
+    BULK_CREATE_BATCH_SIZE = int(os.getenv("BULK_CREATE_BATCH_SIZE", 1000))
+    BULK_CREATE_MAX_RECORD_BYTES = int(os.getenv("BULK_CREATE_MAX_RECORD_BYTES", 1024 * 1024))
+    # max number of per record results (skipped/updated/failed) in the response
+    BULK_CREATE_MAX_RESULTS = int(os.getenv("BULK_CREATE_MAX_RESULTS", 1000))
+    # comma separated sqlalchemy uris of the shards holding the catalogue/archive items
+    DB_SHARD_URIS = [
+        uri.strip() for uri in os.getenv("DB_SHARD_URIS", "").split(",") if uri.strip()
+    ]
+    DB_SHARD_VNODES = int(os.getenv("DB_SHARD_VNODES", 64))
+    DB_SHARD_WORKERS = int(os.getenv("DB_SHARD_WORKERS", 8))
+    # max number of uuids of a multi-get lookup, looked up by chunks of `IN (...)`
+    LOOKUP_MAX_UUIDS = int(os.getenv("LOOKUP_MAX_UUIDS", 10000))
+    LOOKUP_CHUNK_SIZE = int(os.getenv("LOOKUP_CHUNK_SIZE", 1000))
 
 class LocalConfig(BaseConfig):
     DEBUG = os.getenv("FLASK_DEBUG", True)
@@ -28,3 +84,9 @@ class ProdConfig(BaseConfig):
 
 
 CONFIG_BY_ENV = dict(local=LocalConfig, testing=TestingConfig, prod=ProdConfig)
+
+
+def database_uri(cfg) -> str:
+    return cfg.DB_URI or (
+        f"{cfg.DB_TYPE}://{cfg.DB_USER}:{cfg.DB_PASSWORD}@{cfg.DB_HOST}:{cfg.DB_PORT}/{cfg.DB_NAME}"
+    )
@@ -0,0 +1,155 @@
+"""
+Admission control of the expensive endpoints.
+
+Each endpoint class (eg: `heavy` for bulk uploads/archival, `list` for the
+unbounded selects) gets its own concurrency limit and a bounded wait queue:
+
+    - a request is admitted while fewer than `concurrency` requests of its class run
+    - otherwise it waits, as long as fewer than `queue_size` requests are already waiting
+    - a full queue is rejected right away with a 429, a wait longer than
+      `wait_seconds` with a 503, both with a `Retry-After` header
+
+Endpoints without a class (single item lookups, health...) are never limited,
+so they keep being served while the heavy ones are saturated, as long as the
+running + waiting requests of every class stay below the server threads
+(waiting requests hold a thread too).
+"""
+import threading
+import time
+from functools import wraps
+from typing import Dict
+
+from loguru import logger
+
+from src.utils import abort_json
+
+
+class EndpointClassLimiter:
+    def __init__(self, name: str, concurrency: int, queue_size: int, wait_seconds: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.wait_seconds = wait_seconds
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def acquire(self) -> int:
+        """
+        Returns 0 once admitted, else the status code of the rejection.
+        """
+        with self._condition:
+            if self.in_flight < self.concurrency:
+                self.in_flight += 1
+                self.admitted += 1
+                return 0
+            if self.waiting >= self.queue_size:
+                self.rejected_queue_full += 1
+                return 429
+
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            deadline = time.monotonic() + self.wait_seconds
+            try:
+                while self.in_flight >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_timeout += 1
+                        return 503
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            return 0
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def metrics(self) -> dict:
+        with self._condition:
+            return dict(
+                concurrency=self.concurrency,
+                queue_size=self.queue_size,
+                in_flight=self.in_flight,
+                waiting=self.waiting,
+                max_waiting=self.max_waiting,
+                admitted=self.admitted,
+                rejected_queue_full=self.rejected_queue_full,
+                rejected_timeout=self.rejected_timeout,
+            )
+
+
+class AdmissionController:
+    def __init__(
+        self, limits: Dict[str, dict], retry_after_seconds: int = 5, server_threads: int = 0
+    ):
+        """
+        `limits` maps an endpoint class to its
+        `dict(concurrency=.., queue_size=.., wait_seconds=..)`.
+        A class with a concurrency of 0 isn't limited.
+        `server_threads` (threads of a worker) is only used to check the limits.
+        """
+        self.retry_after_seconds = retry_after_seconds
+        self.limiters = {
+            name: EndpointClassLimiter(name, **limit)
+            for name, limit in limits.items()
+            if limit["concurrency"] > 0
+        }
+        if server_threads:
+            self.check_threads(server_threads)
+
+    def check_threads(self, server_threads: int) -> None:
+        """
+        Warn when the limited classes (running + waiting requests) can take
+        every thread, leaving none for the unlimited endpoints.
+        """
+        busy = sum(
+            limiter.concurrency + limiter.queue_size for limiter in self.limiters.values()
+        )
+        if busy >= server_threads:
+            logger.warning(
+                f"Admission limits allow {busy} running/waiting requests for"
+                f" {server_threads} server threads, lower them so unlimited endpoints"
+                " always get a thread"
+            )
+
+    def limit(self, endpoint_class: str):
+        """
+        Decorator applying the limits of `endpoint_class` to a view.
+        """
+
+        def decorator(func):
+            @wraps(func)
+            def decorated(*args, **kwargs):
+                limiter = self.limiters.get(endpoint_class)
+                if limiter is None:
+                    return func(*args, **kwargs)
+                status_code = limiter.acquire()
+                if status_code:
+                    logger.warning(
+                        f"Rejected {func.__name__} ({endpoint_class}) with {status_code}"
+                    )
+                    abort_json(
+                        status_code,
+                        error="SERVER_BUSY",
+                        message=f"Too many concurrent {endpoint_class} requests, retry later.",
+                        headers={"Retry-After": str(self.retry_after_seconds)},
+                    )
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    limiter.release()
+
+            return decorated
+
+        return decorator
+
+    def metrics(self) -> Dict[str, dict]:
+        return {name: limiter.metrics() for name, limiter in self.limiters.items()}
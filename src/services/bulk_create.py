@@ -0,0 +1,370 @@
+"""
+Bulk creation of catalogue items from a streamed JSON body.
+
+The body is either NDJSON (one record per line) or a JSON array of records.
+It is parsed incrementally from the request stream and inserted in batches
+(one SELECT of the existing uuids and one multi-row INSERT per batch), so the
+memory used doesn't depend on the body size. Each batch is committed on its own,
+a failed batch is retried record by record so only the bad records fail.
+
+Existing uuids are skipped, or updated with `on_conflict="update"`.
+"""
+import codecs
+import json
+import uuid
+from datetime import datetime
+from typing import BinaryIO, Iterator, List, Tuple
+
+from dateutil import parser as dt_parser
+from loguru import logger
+from sqlalchemy import Boolean, DateTime, Integer, String, bindparam, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.types import TypeDecorator
+
+import src.constants as CONSTANTS
+from src.services.db.filters import FilterError, normalize_enum_value
+from src.services.db.models import CatalogueItem, db
+from src.services.db.shards import ShardRoutingError, shard_router
+from src.services.db.types import is_valid_id, normalize_id
+from src.services.ingest import IngestError
+from src.services import throughput
+
+ITEM_TABLE = CatalogueItem.__table__
+
+ITEM_COLUMNS = set(ITEM_TABLE.columns.keys())
+
+DATETIME_COLUMNS = {
+    column.name for column in ITEM_TABLE.columns if isinstance(column.type, DateTime)
+}
+
+# columns converted separately (uuid, enums, datetimes)
+CUSTOM_COLUMNS = {"uuid", "transfer_status", "sealed_state"} | DATETIME_COLUMNS
+
+ON_CONFLICT_ACTIONS = ("skip", "update")
+
+READ_BLOCK_SIZE = 64 * 1024
+
+_DECODER = json.JSONDecoder()
+
+
+def _blocks(stream: BinaryIO) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for block in iter(lambda: stream.read(READ_BLOCK_SIZE), b""):
+        yield decoder.decode(block)
+    yield decoder.decode(b"", final=True)
+
+
+def iter_ndjson(stream: BinaryIO, max_record_bytes: int) -> Iterator[Tuple[object, str]]:
+    """
+    Yields (record, error) per non-empty line, a malformed line only fails itself.
+    """
+    buffer = ""
+    for block in _blocks(stream):
+        buffer += block
+        *lines, buffer = buffer.split("\n")
+        if len(buffer) > max_record_bytes:
+            raise IngestError("INSERTION_FAILED", "Record exceeds the maximum size!", 413)
+        for line in lines:
+            if line.strip():
+                yield _loads(line)
+    if buffer.strip():
+        yield _loads(buffer)
+
+
+def _loads(line: str) -> Tuple[object, str]:
+    try:
+        return json.loads(line), ""
+    except ValueError as e:
+        return None, f"Invalid json: {e}"
+
+
+def iter_json_array(stream: BinaryIO, max_record_bytes: int) -> Iterator[Tuple[object, str]]:
+    """
+    Yields (record, "") per element of a JSON array, one element at a time.
+    A malformed array can't be recovered from and raises `IngestError`.
+    """
+    blocks = _blocks(stream)
+    buffer, pos = "", 0
+
+    def fill() -> bool:
+        nonlocal buffer, pos
+        block = next(blocks, None)
+        if block is None:
+            return False
+        buffer, pos = buffer[pos:] + block, 0
+        return True
+
+    def peek() -> str:
+        # next non whitespace character, "" at the end of the body
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ""
+
+    def decode():
+        nonlocal pos
+        while True:
+            try:
+                value, pos = _DECODER.raw_decode(buffer, pos)
+                return value
+            except ValueError as e:
+                if len(buffer) - pos > max_record_bytes:
+                    raise IngestError(
+                        "INSERTION_FAILED", "Record exceeds the maximum size!", 413
+                    )
+                if not fill():
+                    raise IngestError("INSERTION_FAILED", f"Invalid json: {e}")
+
+    if peek() != "[":
+        raise IngestError("INSERTION_FAILED", "Body should be a json array!")
+    pos += 1
+    if peek() == "]":
+        return
+    while True:
+        peek()
+        yield decode(), ""
+        char = peek()
+        if char == "]":
+            return
+        if char != ",":
+            raise IngestError("INSERTION_FAILED", "Invalid json array!")
+        pos += 1
+
+
+def coerce_value(column, value):
+    """
+    Converts a json value to the python type of the column, raises ValueError.
+    """
+    column_type = column.type.impl if isinstance(column.type, TypeDecorator) else column.type
+    if value is None:
+        return None
+    if isinstance(column_type, Boolean):
+        if isinstance(value, bool):
+            return value
+    elif isinstance(column_type, Integer):
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, (int, str)) and not isinstance(value, bool):
+            try:
+                return int(value)
+            except ValueError:
+                pass
+    elif isinstance(column_type, String):
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            return str(value)
+    else:
+        return value
+    raise ValueError(f"Invalid {column.name}: {value!r}")
+
+
+def validate_record(record) -> Tuple[dict, str]:
+    """
+    Returns the record ready to insert, or an error message.
+    """
+    if not isinstance(record, dict):
+        return None, "Record should be a json object"
+    missing = [
+        field
+        for field in CONSTANTS.CATALOGUE_POST_MANDATORY_FIELDS
+        if record.get(field) in (None, "")
+    ]
+    if missing:
+        return None, f"Missing {missing}"
+    unknown = set(record) - ITEM_COLUMNS
+    if unknown:
+        return None, f"Unknown fields {sorted(unknown)}"
+
+    data = dict(record)
+    data["uuid"] = data.get("uuid") or uuid.uuid4().hex
+    if not is_valid_id(data["uuid"]):
+        return None, "Invalid uuid"
+    data["uuid"] = normalize_id(data["uuid"])
+    try:
+        for field in set(data) - CUSTOM_COLUMNS:
+            data[field] = coerce_value(ITEM_TABLE.c[field], data[field])
+        for field in ("transfer_status", "sealed_state"):
+            if data.get(field) is not None:
+                data[field] = normalize_enum_value(field, data[field])
+        for field in DATETIME_COLUMNS & set(data):
+            if isinstance(data[field], str):
+                data[field] = dt_parser.parse(data[field])
+    except (FilterError, ValueError, OverflowError) as e:
+        return None, str(e)
+    data["updated_on"] = datetime.now()
+    return data, ""
+
+
+class BulkCreator:
+    def __init__(
+        self, on_conflict: str = "skip", batch_size: int = 1000, max_results: int = 1000
+    ):
+        if on_conflict not in ON_CONFLICT_ACTIONS:
+            raise IngestError(
+                "INSERTION_FAILED", f"on_conflict should be one of {ON_CONFLICT_ACTIONS}"
+            )
+        self.on_conflict = on_conflict
+        self.batch_size = batch_size
+        self.max_results = max_results
+        self.counts = dict(received=0, created=0, updated=0, skipped=0, failed=0)
+        # per record results, except the created ones
+        self.results = []
+        self.truncated = False
+
+    def _result(self, index: int, uuid, status: str, error: str = "") -> None:
+        self.counts[status] += 1
+        if len(self.results) < self.max_results:
+            self.results.append(dict(index=index, uuid=uuid, status=status, error=error))
+        else:
+            self.truncated = True
+
+    def run(self, records: Iterator[Tuple[object, str]]) -> dict:
+        """
+        Insert the records, returns the summary. When the body turns out
+        malformed, the records parsed so far are inserted before raising.
+        """
+        batch = []
+        try:
+            for index, (record, error) in enumerate(records):
+                self.counts["received"] += 1
+                data = None
+                if not error:
+                    data, error = validate_record(record)
+                if error:
+                    item_id = record.get("uuid") if isinstance(record, dict) else None
+                    self._result(index, item_id, "failed", error)
+                    continue
+                batch.append((index, data))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+        finally:
+            if batch:
+                self._flush(batch)
+        return self.summary()
+
+    def summary(self) -> dict:
+        return dict(self.counts, results=self.results, truncated=self.truncated)
+
+    def _flush(self, batch: List[Tuple[int, dict]]) -> None:
+        # later occurrences of an uuid within the batch are merged into the first
+        records = {}
+        for index, data in batch:
+            if data["uuid"] in records:
+                if self.on_conflict == "update":
+                    records[data["uuid"]][1].update(data)
+                    self._result(index, data["uuid"], "updated")
+                else:
+                    self._result(index, data["uuid"], "skipped", "uuid already exists")
+                continue
+            records[data["uuid"]] = (index, data)
+
+        try:
+            existing = self._write(records)
+            # commits the transaction of every shard involved
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Bulk create batch of {len(records)} records failed: {e}")
+            self._replay(records)
+            return
+        self._report(records, existing)
+
+    def _replay(self, records: dict) -> None:
+        # a record failing the whole batch only fails itself
+        for uuid, record in records.items():
+            try:
+                existing = self._write({uuid: record})
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Bulk create of {uuid} failed: {e}")
+                error = (
+                    str(e) if isinstance(e, ShardRoutingError) else "Unable to insert the record"
+                )
+                self._result(record[0], uuid, "failed", error)
+                continue
+            self._report({uuid: record}, existing)
+
+    def _write(self, records: dict) -> set:
+        """
+        Inserts the new records, updates the existing ones with
+        `on_conflict="update"`. Returns the existing uuids, uncommitted.
+        """
+        located = shard_router.locate(CatalogueItem, list(records))
+        existing = {uuid for found in located.values() for uuid in found}
+        new = {}
+        for uuid, (_, data) in records.items():
+            if uuid not in existing:
+                shard = shard_router.shard_for(data["source_storage_id"])
+                new.setdefault(shard, []).append(data)
+        for shard, shard_new in new.items():
+            with shard_router.use(shard):
+                self._insert(shard_new)
+        if self.on_conflict == "update":
+            # existing items are updated on the shard holding them
+            for shard, found in located.items():
+                with shard_router.use(shard):
+                    for uuid in found:
+                        shard_router.check_update(CatalogueItem, shard, records[uuid][1])
+                    self._update({uuid: records[uuid][1] for uuid in found})
+        return existing
+
+    def _report(self, records: dict, existing: set) -> None:
+        self.counts["created"] += len(records) - len(existing)
+        for uuid in existing:
+            index = records[uuid][0]
+            if self.on_conflict == "update":
+                self._result(index, uuid, "updated")
+            else:
+                self._result(index, uuid, "skipped", "uuid already exists")
+
+    def _insert(self, new: List[dict]) -> None:
+        for data in new:
+            data["transfer_status"] = data.get("transfer_status") or "NOT_STARTED"
+            data["created_on"] = data.get("created_on") or data["updated_on"]
+        # records are inserted with the same set of columns
+        columns = sorted(set().union(*new))
+        values = [{column: data.get(column) for column in columns} for data in new]
+        dialect = db.session.get_bind(mapper=CatalogueItem).dialect.name
+        if dialect == "postgresql":
+            statement = postgresql.insert(ITEM_TABLE).on_conflict_do_nothing(
+                index_elements=["uuid"]
+            )
+        elif dialect == "sqlite":
+            statement = sqlite.insert(ITEM_TABLE).on_conflict_do_nothing(
+                index_elements=["uuid"]
+            )
+        else:
+            statement = insert(ITEM_TABLE)
+        db.session.execute(statement, values)
+        throughput.record(
+            db.session.connection(),
+            [data for data in new if data["transfer_status"] in throughput.TERMINAL_STATUSES],
+        )
+
+    def _update(self, updates: dict) -> None:
+        updates = {
+            uuid: {k: v for k, v in data.items() if k not in ("uuid", "created_on")}
+            for uuid, data in updates.items()
+        }
+        throughput.record_updates(db.session, CatalogueItem, updates)
+        groups = {}
+        for uuid, data in updates.items():
+            groups.setdefault(tuple(sorted(data)), []).append((uuid, data))
+        for columns, items in groups.items():
+            statement = (
+                update(ITEM_TABLE)
+                .where(ITEM_TABLE.c.uuid == bindparam("b_uuid"))
+                .values({column: bindparam(f"b_{column}") for column in columns})
+            )
+            db.session.execute(
+                statement,
+                [
+                    dict({f"b_{column}": data[column] for column in columns}, b_uuid=uuid)
+                    for uuid, data in items
+                ],
+            )
@@ -0,0 +1,27 @@
+"""
+Background daemon threads started on first use.
+"""
+import threading
+from typing import Callable
+
+
+class LazyThread:
+    """
+    Daemon thread running `target`, started (or restarted if it died) by
+    `ensure_started`. Starting it lazily instead of at import gives each
+    (forked) worker process its own thread.
+    """
+
+    def __init__(self, target: Callable[[], None], name: str):
+        self.target = target
+        self.name = name
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.target, name=self.name, daemon=True
+                )
+                self._thread.start()
@@ -0,0 +1,78 @@
+"""
+Create the indexes declared on the models which are missing in the database,
+and drop the ones they replaced (`OBSOLETE_INDEXES`).
+
+    python -m src.services.db.create_indexes
+
+`db.create_all()` only creates missing tables, so indexes added to existing
+tables need this. The shards (`DB_SHARD_URIS`) are indexed too.
+On postgresql the indexes are built (and dropped) CONCURRENTLY, without
+blocking the writes.
+"""
+import os
+
+from loguru import logger
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.schema import CreateIndex
+
+from src.config import CONFIG_BY_ENV, database_uri
+
+from .models import CatalogueItem, db
+
+CFG = CONFIG_BY_ENV[os.getenv("FLASK_ENV", "local")]
+
+# single column indexes made redundant by the composite indexes they lead
+OBSOLETE_INDEXES = {
+    CatalogueItem.__tablename__: [
+        f"ix_{CatalogueItem.__tablename__}_transfer_status",
+        f"ix_{CatalogueItem.__tablename__}_source_storage_id",
+        f"ix_{CatalogueItem.__tablename__}_dest_storage_id",
+    ],
+}
+
+
+def create_missing_indexes(engine) -> None:
+    inspector = inspect(engine)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                statement = str(CreateIndex(index).compile(dialect=engine.dialect))
+                if engine.dialect.name == "postgresql":
+                    statement = statement.replace(
+                        "CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1
+                    )
+                logger.info(statement)
+                conn.exec_driver_sql(statement)
+
+
+def drop_obsolete_indexes(engine) -> None:
+    inspector = inspect(engine)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table, indexes in OBSOLETE_INDEXES.items():
+            if not inspector.has_table(table):
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table)}
+            for name in indexes:
+                if name not in existing:
+                    continue
+                concurrently = "CONCURRENTLY " if engine.dialect.name == "postgresql" else ""
+                statement = f"DROP INDEX {concurrently}{name}"
+                logger.info(statement)
+                conn.exec_driver_sql(statement)
+
+
+def main():
+    for uri in [database_uri(CFG)] + CFG.DB_SHARD_URIS:
+        engine = create_engine(uri)
+        # the replacing indexes are built before dropping the old ones
+        create_missing_indexes(engine)
+        drop_obsolete_indexes(engine)
+
+
+if __name__ == "__main__":
+    main()
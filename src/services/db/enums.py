@@ -13,3 +13,9 @@ class SealedStatus(Enum):
     UNSEALED = "UNSEALED"
     UNSEALING = "UNSEALING"
     PERMANENT_UNSEALED = "PERMANENT_UNSEALED"
+
+
+class ManifestStatus(Enum):
+    INGESTING = "INGESTING"
+    INGESTED = "INGESTED"
+    FAILED = "FAILED"
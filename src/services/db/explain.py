@@ -0,0 +1,49 @@
+import re
+from typing import List
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+
+# index names in the plan lines of sqlite and postgresql
+PLAN_INDEX_PATTERN = re.compile(
+    r"(?:USING (?:COVERING )?INDEX|Index (?:Only )?Scan(?: Backward)? using"
+    r"|Bitmap Index Scan on) (\w+)"
+)
+
+
+class Explain(Executable, ClauseElement):
+    """
+    EXPLAIN of a select statement (EXPLAIN QUERY PLAN on sqlite).
+    The parameters go through the regular column type processing.
+    """
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    prefix = "EXPLAIN QUERY PLAN" if compiler.dialect.name == "sqlite" else "EXPLAIN"
+    return f"{prefix} {compiler.process(element.statement, **kw)}"
+
+
+def explain(session, statement, mapper=None) -> List[str]:
+    """
+    Query plan lines of a statement, run on the bind the session would
+    pick for the statement itself (eg: a read replica).
+    """
+    rows = session.execute(
+        Explain(statement), bind_arguments=dict(clause=statement, mapper=mapper)
+    )
+    return [str(row[-1]) for row in rows]
+
+
+def plan_indexes(plan: List[str]) -> List[str]:
+    """
+    Indexes used by a query plan (see `explain`), in plan order.
+    """
+    found = [match for line in plan for match in PLAN_INDEX_PATTERN.findall(line)]
+    return list(dict.fromkeys(found))
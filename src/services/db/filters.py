@@ -0,0 +1,218 @@
+from typing import Any, Dict, List
+
+from dateutil import parser as dt_parser
+from sqlalchemy import or_
+
+from .enums import SealedStatus, TransferStatus
+from .models import CatalogueItem
+
+# filters that accept a single value or a list of values
+EQUALITY_FILTERS = (
+    "source_storage_id",
+    "dest_storage_id",
+    "transfer_status",
+    "sealed_state",
+)
+
+# filters that accept a {"from": <datetime>, "to": <datetime>} range
+DATE_RANGE_FILTERS = (
+    "ingestion_date",
+    "content_date_start",
+)
+
+# filters that accept a {"from": <int>, "to": <int>} range
+NUMBER_RANGE_FILTERS = ("content_length",)
+
+RANGE_FILTERS = DATE_RANGE_FILTERS + NUMBER_RANGE_FILTERS
+
+# filter combinations allowed on the list/count endpoints and the composite
+# index (see `CatalogueItem.__table_args__`) backing them:
+# index -> (equality filters, allowed range filters)
+# (None as range filter means no range filter)
+FILTER_INDEXES = {
+    "ix_catalogue_item_status_state_expiry": (
+        ("transfer_status", "sealed_state"),
+        (None,),
+    ),
+    "ix_catalogue_item_status_state_ingestion": (
+        ("transfer_status", "sealed_state"),
+        ("ingestion_date",),
+    ),
+    "ix_catalogue_item_status_state_content_start": (
+        ("transfer_status", "sealed_state"),
+        ("content_date_start",),
+    ),
+    "ix_catalogue_item_status_state_length": (
+        ("transfer_status", "sealed_state"),
+        ("content_length",),
+    ),
+    "ix_catalogue_item_source_status_state_ingestion": (
+        ("source_storage_id", "transfer_status", "sealed_state"),
+        (None, "ingestion_date"),
+    ),
+    "ix_catalogue_item_source_status_state_content_start": (
+        ("source_storage_id", "transfer_status", "sealed_state"),
+        ("content_date_start",),
+    ),
+    "ix_catalogue_item_dest_status_state_ingestion": (
+        ("dest_storage_id", "transfer_status", "sealed_state"),
+        (None, "ingestion_date"),
+    ),
+    "ix_catalogue_item_source_dest_status_state_ingestion": (
+        ("source_storage_id", "dest_storage_id", "transfer_status", "sealed_state"),
+        (None, "ingestion_date"),
+    ),
+}
+
+# (equality filters, range filter) -> index
+FILTER_INDEX_WHITELIST = {
+    (frozenset(equality), range_field): index
+    for index, (equality, range_fields) in FILTER_INDEXES.items()
+    for range_field in range_fields
+}
+
+ENUM_VALUES = {
+    "transfer_status": {s.value for s in TransferStatus},
+    "sealed_state": {s.value for s in SealedStatus},
+}
+
+
+class FilterError(ValueError):
+    pass
+
+
+def _as_list(value: Any) -> List[Any]:
+    return value if isinstance(value, (list, tuple)) else [value]
+
+
+def normalize_enum_value(field: str, value: Any) -> Any:
+    if field not in ENUM_VALUES:
+        return value
+    value = str(value).strip().upper()
+    if value not in ENUM_VALUES[field]:
+        raise FilterError(f"Invalid {field}={value}")
+    return value
+
+
+def _parse_bound(field: str, value: Any):
+    try:
+        if field in NUMBER_RANGE_FILTERS:
+            return int(value)
+        return dt_parser.parse(value)
+    except (TypeError, ValueError, OverflowError):
+        raise FilterError(f"Invalid value for {field}: {value}")
+
+
+def normalize_filters(filters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate a filter dict.
+
+    Example:
+        ..code-block:: json
+
+            {
+                "source_storage_id": ["container-a", "container-b"],
+                "transfer_status": "FAILED",
+                "ingestion_date": {"from": "2022-01-01", "to": "2022-02-01"}
+            }
+
+    Equality filters are returned as a list of values and ranges as a
+    {"from": <datetime|int|None>, "to": <datetime|int|None>} dict (`to` is exclusive).
+    Raises `FilterError` for unknown fields or invalid values.
+    """
+    if filters is not None and not isinstance(filters, dict):
+        raise FilterError("filter should be a json object")
+    normalized = {}
+    for field, value in (filters or {}).items():
+        if field in EQUALITY_FILTERS:
+            values = [normalize_enum_value(field, v) for v in _as_list(value)]
+            if not values:
+                raise FilterError(f"Empty value list for {field}")
+            normalized[field] = values
+        elif field in RANGE_FILTERS:
+            if not isinstance(value, dict) or not ({"from", "to"} & value.keys()):
+                raise FilterError(f"{field} expects a {{'from': .., 'to': ..}} range")
+            normalized[field] = {
+                bound: _parse_bound(field, value[bound])
+                if value.get(bound) not in (None, "")
+                else None
+                for bound in ("from", "to")
+            }
+        else:
+            raise FilterError(f"Unsupported filter: {field}")
+    return normalized
+
+
+def filters_from_args(args) -> Dict[str, Any]:
+    """
+    Build a filter dict from query parameters:
+        - <field>=<value>[,<value>...] for the equality filters
+        - <field>_from=<value> and/or <field>_to=<value> for the ranges
+    """
+    filters = {}
+    for field in EQUALITY_FILTERS:
+        if args.get(field):
+            filters[field] = [v for v in args[field].split(",") if v.strip()]
+    for field in RANGE_FILTERS:
+        bounds = {
+            bound: args.get(f"{field}_{bound}")
+            for bound in ("from", "to")
+            if args.get(f"{field}_{bound}")
+        }
+        if bounds:
+            filters[field] = bounds
+    return filters
+
+
+def catalogue_filters(filters: Dict[str, Any], model=CatalogueItem) -> list:
+    """
+    Convert a filter dict (see `normalize_filters`) into sqlalchemy clauses
+    over `model` (`CatalogueItem` or `CatalogueArchiveItem`).
+    """
+    clauses = []
+    for field, value in normalize_filters(filters).items():
+        column = getattr(model, field)
+        if field in EQUALITY_FILTERS:
+            clauses.append(column == value[0] if len(value) == 1 else column.in_(value))
+        else:
+            if value["from"] is not None:
+                clauses.append(column >= value["from"])
+            if value["to"] is not None:
+                clauses.append(column < value["to"])
+    return clauses
+
+
+def filter_index(filters: Dict[str, Any]) -> str:
+    """
+    Name of the index backing a filter dict (see `FILTER_INDEX_WHITELIST`).
+    Raises `FilterError` for a combination which isn't whitelisted.
+    """
+    filters = normalize_filters(filters)
+    ranges = [field for field in filters if field in RANGE_FILTERS]
+    if len(ranges) > 1:
+        raise FilterError(f"Only one range filter is supported, got: {ranges}")
+    key = (
+        frozenset(field for field in filters if field in EQUALITY_FILTERS),
+        ranges[0] if ranges else None,
+    )
+    if key not in FILTER_INDEX_WHITELIST:
+        supported = [
+            sorted(equality) + ([f"{range_field} range"] if range_field else [])
+            for equality, range_field in FILTER_INDEX_WHITELIST
+        ]
+        raise FilterError(
+            f"Unsupported filter combination: {sorted(filters)}. Supported: {supported}"
+        )
+    return FILTER_INDEX_WHITELIST[key]
+
+
+def pending_target_clause(target: Dict[str, Any], model=CatalogueItem):
+    """
+    Clause matching rows which aren't already in the target state.
+    """
+    return or_(
+        *[
+            or_(getattr(model, field) != value, getattr(model, field).is_(None))
+            for field, value in target.items()
+        ]
+    )
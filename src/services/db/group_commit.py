@@ -0,0 +1,249 @@
+"""
+Group commit of the single item PATCHes.
+
+Instead of a SELECT, an UPDATE and a commit per request, concurrent patches are
+queued and flushed by a background thread every `window_ms` (or as soon as
+`max_batch` patches are queued):
+
+    - patches of the same item are merged in arrival order (last value wins)
+    - items sharing the same set of updated columns are updated with a single
+      executemany UPDATE, and the whole batch is committed once
+    - every caller is acknowledged with the item as committed by its batch,
+      so a caller may see the values of a later patch merged into the same batch
+
+A failed batch is replayed item by item so only the offending patches fail.
+With sharding (see `shards`), the items of each shard are committed separately.
+"""
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from datetime import datetime
+from queue import Empty, Queue
+from typing import Dict, List
+
+from loguru import logger
+from sqlalchemy import bindparam, select, update
+
+from .background import LazyThread
+from .shards import ShardRoutingError, current_shard, shard_router
+from .types import normalize_id
+
+# columns a patch can't change (see the models' `update`)
+PROTECTED_COLUMNS = ("uuid", "created_on", "updated_on")
+
+
+class GroupCommitError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class _Patch:
+    def __init__(self, model, uuid: str, data: dict):
+        self.model = model
+        self.uuid = uuid
+        self.data = data
+        self.future = Future()
+
+
+class GroupCommitter:
+    def __init__(
+        self,
+        db,
+        schemas: Dict[type, object],
+        window_ms: float = 5,
+        max_batch: int = 500,
+        timeout_seconds: float = 30,
+        before_update=None,
+    ):
+        """
+        `schemas` maps each patchable model to the schema used to dump
+        the committed items.
+        `before_update(session, model, {uuid: data})` is called before each
+        batch update, within its transaction.
+        """
+        self.db = db
+        self.schemas = schemas
+        self.before_update = before_update
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.timeout_seconds = timeout_seconds
+        self.app = None
+        self._queue = Queue()
+        self._thread = LazyThread(self._run, "group-commit")
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+    def submit(self, model, uuid: str, data: dict) -> dict:
+        """
+        Queue a patch and block until its batch is committed.
+        Returns the dumped item, raises `GroupCommitError` on failure.
+        """
+        columns = set(model.__table__.columns.keys()) - set(PROTECTED_COLUMNS)
+        patch = _Patch(
+            model,
+            normalize_id(uuid),
+            {k: v for k, v in (data or {}).items() if k in columns},
+        )
+        self._thread.ensure_started()
+        self._queue.put(patch)
+        try:
+            return patch.future.result(timeout=self.timeout_seconds)
+        except TimeoutError:
+            raise GroupCommitError("Timed out waiting for the group commit.", 503)
+
+    def _collect(self) -> List[_Patch]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            with self.app.app_context():
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    logger.exception("Group commit failed")
+                    for patch in batch:
+                        if not patch.future.done():
+                            patch.future.set_exception(GroupCommitError(str(e)))
+                finally:
+                    self.db.session.remove()
+
+    def _flush(self, batch: List[_Patch]) -> None:
+        # (model, uuid) -> merged patch data
+        merged = OrderedDict()
+        for patch in batch:
+            merged.setdefault((patch.model, patch.uuid), {}).update(patch.data)
+
+        results = {}
+        for shard, shard_merged in self._partition(merged).items():
+            with shard_router.use(shard):
+                results.update(self._commit(shard_merged))
+
+        for patch in batch:
+            # items not found on any shard
+            result = results.get(
+                (patch.model, patch.uuid), GroupCommitError("uuid doesn't exist!", 404)
+            )
+            if isinstance(result, Exception):
+                patch.future.set_exception(result)
+            else:
+                patch.future.set_result(result)
+        logger.debug(f"Group committed {len(batch)} patches of {len(merged)} items")
+
+    def _partition(self, merged: Dict[tuple, dict]) -> Dict[object, Dict[tuple, dict]]:
+        """
+        Shard -> merged patches of the items it holds, each shard is committed
+        on its own.
+        """
+        uuids_by_model = OrderedDict()
+        for model, uuid in merged:
+            uuids_by_model.setdefault(model, []).append(uuid)
+        partitions = OrderedDict()
+        for model, uuids in uuids_by_model.items():
+            for shard, found in shard_router.route(model, uuids).items():
+                for uuid in found:
+                    key = (model, uuid)
+                    partitions.setdefault(shard, OrderedDict())[key] = merged[key]
+        return partitions
+
+    def _commit(self, merged: Dict[tuple, dict]) -> Dict[tuple, object]:
+        try:
+            self._update(merged)
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            logger.warning(f"Group commit of {len(merged)} items failed, replaying")
+            return self._replay(merged)
+        return self._dump(merged)
+
+    def _update(self, merged: Dict[tuple, dict]) -> None:
+        """
+        One executemany UPDATE per (model, updated columns).
+        """
+        now = datetime.now()
+        groups, updates = OrderedDict(), OrderedDict()
+        for (model, uuid), data in merged.items():
+            shard_router.check_update(model, current_shard(), data)
+            key = (model, tuple(sorted(data)))
+            groups.setdefault(key, []).append((uuid, data))
+            updates.setdefault(model, {})[uuid] = data
+
+        if self.before_update:
+            for model, model_updates in updates.items():
+                self.before_update(self.db.session, model, model_updates)
+
+        for (model, columns), items in groups.items():
+            table = model.__table__
+            values = {column: bindparam(f"b_{column}") for column in columns}
+            if columns:
+                values["updated_on"] = bindparam("b_updated_on")
+            if not values:
+                continue
+            statement = (
+                update(table).where(table.c.uuid == bindparam("b_uuid")).values(values)
+            )
+            self.db.session.execute(
+                statement,
+                [
+                    dict(
+                        {f"b_{column}": data[column] for column in columns},
+                        b_uuid=uuid,
+                        b_updated_on=now,
+                    )
+                    for uuid, data in items
+                ],
+            )
+
+    def _dump(self, merged: Dict[tuple, dict]) -> Dict[tuple, object]:
+        """
+        Committed items (or a 404 for the missing ones), fetched with one SELECT per model.
+        """
+        results = {}
+        uuids_by_model = OrderedDict()
+        for model, uuid in merged:
+            uuids_by_model.setdefault(model, []).append(uuid)
+        for model, uuids in uuids_by_model.items():
+            items = {
+                item.uuid: item
+                for item in self.db.session.execute(
+                    select(model).where(model.uuid.in_(uuids))
+                ).scalars()
+            }
+            for uuid in uuids:
+                item = items.get(uuid)
+                results[(model, uuid)] = (
+                    self.schemas[model].dump(item)
+                    if item is not None
+                    else GroupCommitError("uuid doesn't exist!", 404)
+                )
+        return results
+
+    def _replay(self, merged: Dict[tuple, dict]) -> Dict[tuple, object]:
+        results = {}
+        for key, data in merged.items():
+            try:
+                self._update({key: data})
+                self.db.session.commit()
+                results.update(self._dump({key: data}))
+            except Exception as e:
+                self.db.session.rollback()
+                logger.error(f"Group commit of {key[1]} failed: {e}")
+                results[key] = GroupCommitError(
+                    str(e)
+                    if isinstance(e, ShardRoutingError)
+                    else "Unable to update the catalogue item."
+                )
+        return results
@@ -0,0 +1,209 @@
+"""
+Migrate existing (postgresql) catalogue tables to the compact schema.
+
+    python -m src.services.db.migrate_compact --benchmark
+
+- ids are converted to the native `uuid` type
+- `transfer_status`/`sealed_state` become smallint enum codes (see `types.EnumCode`)
+- storage ids become integer codes of the storage id dictionary table
+
+The tables are rewritten, so stop the api (or run in a maintenance window)
+and start it again with `DB_COMPACT_SCHEMA=true` afterwards.
+With `--benchmark`, index sizes and `IN (...)` lookup timings are reported
+before and after the migration.
+Only the default database is migrated, the shards (`DB_SHARD_URIS`) aren't.
+"""
+import argparse
+import os
+import statistics
+import time
+from typing import Dict, List
+
+from loguru import logger
+from sqlalchemy import create_engine, text
+
+from src.config import CONFIG_BY_ENV, database_uri
+
+from .create_indexes import create_missing_indexes
+from .enums import SealedStatus, TransferStatus
+from .models import (
+    CatalogueArchiveItem,
+    CatalogueItem,
+    CatalogueParquetUuidIndex,
+    CatalogueTransferTracker,
+    storage_id_dictionary,
+)
+
+CFG = CONFIG_BY_ENV[os.getenv("FLASK_ENV", "local")]
+
+CATALOGUE_COMPACT_COLUMNS = dict(
+    enums={"transfer_status": TransferStatus, "sealed_state": SealedStatus},
+    storage_ids=["source_storage_id", "dest_storage_id"],
+)
+
+TABLES = {
+    CatalogueItem.__tablename__: CATALOGUE_COMPACT_COLUMNS,
+    CatalogueArchiveItem.__tablename__: CATALOGUE_COMPACT_COLUMNS,
+    CatalogueTransferTracker.__tablename__: dict(enums={}, storage_ids=[]),
+    CatalogueParquetUuidIndex.__tablename__: dict(enums={}, storage_ids=[]),
+}
+
+DICTIONARY_TABLE = storage_id_dictionary.name
+
+
+def column_type(conn, table: str, column: str) -> str:
+    return conn.execute(
+        text(
+            "SELECT data_type FROM information_schema.columns"
+            " WHERE table_name = :table AND column_name = :column"
+        ),
+        dict(table=table, column=column),
+    ).scalar()
+
+
+def migration_statements(conn, table: str, spec: dict) -> List[str]:
+    """
+    SQL statements converting a single table, skipping already converted columns.
+    """
+    statements = []
+    if column_type(conn, table, "uuid") != "uuid":
+        statements.append(
+            f"ALTER TABLE {table} ALTER COLUMN uuid TYPE uuid USING uuid::uuid"
+        )
+
+    for column, enum_class in spec["enums"].items():
+        if column_type(conn, table, column) == "smallint":
+            continue
+        values = [member.value for member in enum_class]
+        quoted = ", ".join(f"'{value}'" for value in values)
+        unknown = conn.execute(
+            text(
+                f"SELECT DISTINCT {column} FROM {table}"
+                f" WHERE {column} IS NOT NULL AND {column} NOT IN ({quoted})"
+            )
+        ).scalars().all()
+        if unknown:
+            raise ValueError(f"{table}.{column} has unknown values: {unknown}")
+        cases = " ".join(
+            f"WHEN '{value}' THEN {code}" for code, value in enumerate(values)
+        )
+        statements.append(
+            f"ALTER TABLE {table} ALTER COLUMN {column} TYPE smallint"
+            f" USING CASE {column} {cases} END"
+        )
+
+    for column in spec["storage_ids"]:
+        if column_type(conn, table, column) == "integer":
+            continue
+        statements += [
+            f"INSERT INTO {DICTIONARY_TABLE} (value) SELECT DISTINCT {column} FROM {table}"
+            f" WHERE {column} IS NOT NULL ON CONFLICT (value) DO NOTHING",
+            f"ALTER TABLE {table} ADD COLUMN {column}__code integer",
+            f"UPDATE {table} SET {column}__code = d.id FROM {DICTIONARY_TABLE} d"
+            f" WHERE d.value = {table}.{column}",
+            f"ALTER TABLE {table} DROP COLUMN {column}",
+            f"ALTER TABLE {table} RENAME COLUMN {column}__code TO {column}",
+        ]
+    return statements
+
+
+def index_sizes(conn, table: str) -> Dict[str, int]:
+    rows = conn.execute(
+        text(
+            "SELECT indexrelname, pg_relation_size(indexrelid) FROM pg_stat_user_indexes"
+            " WHERE relname = :table"
+        ),
+        dict(table=table),
+    )
+    return dict(rows.all())
+
+
+def sample_ids(conn, table: str, size: int) -> List[str]:
+    return conn.execute(
+        text(f"SELECT uuid::text FROM {table} ORDER BY random() LIMIT :size"),
+        dict(size=size),
+    ).scalars().all()
+
+
+def lookup_ms(conn, table: str, ids: List[str], repeat: int) -> float:
+    """
+    Median time of a `uuid IN (...)` lookup of the given ids.
+    """
+    cast = "uuid[]" if column_type(conn, table, "uuid") == "uuid" else "text[]"
+    query = text(f"SELECT uuid FROM {table} WHERE uuid = ANY(CAST(:ids AS {cast}))")
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(query, dict(ids=ids)).all()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def benchmark(engine, samples: Dict[str, List[str]], repeat: int) -> Dict[str, dict]:
+    report = {}
+    with engine.connect() as conn:
+        for table in TABLES:
+            report[table] = dict(
+                index_sizes=index_sizes(conn, table),
+                lookup_ms=lookup_ms(conn, table, samples[table], repeat)
+                if samples[table]
+                else None,
+            )
+    return report
+
+
+def log_report(before: dict, after: dict) -> None:
+    for table in TABLES:
+        logger.info(f"== {table}")
+        for index, size in after[table]["index_sizes"].items():
+            old = before[table]["index_sizes"].get(index)
+            old = f"{old / 1024 ** 2:.2f}MB" if old is not None else "-"
+            logger.info(f"{index}: {old} -> {size / 1024 ** 2:.2f}MB")
+        logger.info(
+            f"IN lookup: {before[table]['lookup_ms']} ms -> {after[table]['lookup_ms']} ms"
+        )
+
+
+def migrate(engine, dry_run: bool = False) -> None:
+    storage_id_dictionary.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        for table, spec in TABLES.items():
+            for statement in migration_statements(conn, table, spec):
+                logger.info(statement)
+                if not dry_run:
+                    conn.execute(text(statement))
+    if dry_run:
+        return
+    # indexes on the replaced storage id columns were dropped along with them
+    create_missing_indexes(engine)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table in TABLES:
+            conn.execute(text(f"VACUUM ANALYZE {table}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only log the SQL")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--lookup-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(database_uri(CFG))
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("The migration only supports postgresql.")
+
+    before, samples = None, {}
+    if args.benchmark:
+        with engine.connect() as conn:
+            samples = {t: sample_ids(conn, t, args.lookup_size) for t in TABLES}
+        before = benchmark(engine, samples, args.repeat)
+
+    migrate(engine, dry_run=args.dry_run)
+
+    if args.benchmark and not args.dry_run:
+        log_report(before, benchmark(engine, samples, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,23 @@ from datetime import datetime
 
 from flask_sqlalchemy import SQLAlchemy
 
-from .enums import TransferStatus
+from .enums import SealedStatus, TransferStatus
+from .replicas import RoutingSession
+from .types import CompactUUID, DictionaryEncoded, EnumCode, StringDictionary
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 TABLE_PREFIX = "catalogue_"
 
+# value dictionary for the storage id columns of the compact schema
+storage_id_dictionary = db.Table(
+    f"{TABLE_PREFIX}storage_id_dictionary",
+    db.Column("id", db.Integer, primary_key=True),
+    db.Column("value", db.String, unique=True, nullable=False),
+)
+storage_ids = StringDictionary(storage_id_dictionary)
+storage_ids.init_db(db)
+
 
 class CatalogueItem(db.Model):
     """
@@ -22,7 +33,65 @@ class CatalogueItem(db.Model):
     """
 
     __tablename__ = f"{TABLE_PREFIX}catalogue_item"
-    uuid = db.Column(db.String, primary_key=True)
+    # composite indexes backing the list/count filters (see `filters.FILTER_INDEXES`)
+    __table_args__ = (
+        db.Index(
+            "ix_catalogue_item_status_state_expiry",
+            "transfer_status",
+            "sealed_state",
+            "unseal_expiry_time",
+        ),
+        db.Index(
+            "ix_catalogue_item_status_state_ingestion",
+            "transfer_status",
+            "sealed_state",
+            "ingestion_date",
+        ),
+        db.Index(
+            "ix_catalogue_item_status_state_content_start",
+            "transfer_status",
+            "sealed_state",
+            "content_date_start",
+        ),
+        db.Index(
+            "ix_catalogue_item_status_state_length",
+            "transfer_status",
+            "sealed_state",
+            "content_length",
+        ),
+        db.Index(
+            "ix_catalogue_item_source_status_state_ingestion",
+            "source_storage_id",
+            "transfer_status",
+            "sealed_state",
+            "ingestion_date",
+        ),
+        db.Index(
+            "ix_catalogue_item_source_status_state_content_start",
+            "source_storage_id",
+            "transfer_status",
+            "sealed_state",
+            "content_date_start",
+        ),
+        db.Index(
+            "ix_catalogue_item_dest_status_state_ingestion",
+            "dest_storage_id",
+            "transfer_status",
+            "sealed_state",
+            "ingestion_date",
+        ),
+        db.Index(
+            "ix_catalogue_item_source_dest_status_state_ingestion",
+            "source_storage_id",
+            "dest_storage_id",
+            "transfer_status",
+            "sealed_state",
+            "ingestion_date",
+        ),
+        # stored on the shard of its source_storage_id (see `shards.ShardRouter`)
+        {"info": {"sharded": True}},
+    )
+    uuid = db.Column(CompactUUID, primary_key=True)
     source_path = db.Column(db.String)
     destination_path = db.Column(db.String)
     content_length = db.Column(db.BIGINT)
@@ -33,8 +102,9 @@ class CatalogueItem(db.Model):
     checksum_value = db.Column(db.String)
 
     transfer_id = db.Column(db.String)
+    # transfer_status and the storage ids lead composite indexes (see `__table_args__`)
     transfer_status = db.Column(
-        db.String, default=TransferStatus.NOT_STARTED.value, index=True
+        EnumCode(TransferStatus), default=TransferStatus.NOT_STARTED.value
     )
     transfer_checksum_value = db.Column(db.String, nullable=True)
     transfer_checksum_verification = db.Column(db.String(20), nullable=True)
@@ -43,12 +113,13 @@ class CatalogueItem(db.Model):
     transfer_source = db.Column(db.String, nullable=True)
     transfer_destination = db.Column(db.String, nullable=True)
 
-    sealed_state = db.Column(db.String, index=True)
+    # no composite index starts with sealed_state
+    sealed_state = db.Column(EnumCode(SealedStatus), index=True)
     unseal_time = db.Column(db.DateTime, nullable=True)
     unseal_expiry_time = db.Column(db.DateTime, nullable=True)
 
-    source_storage_id = db.Column(db.String, index=True)
-    dest_storage_id = db.Column(db.String, index=True)
+    source_storage_id = db.Column(DictionaryEncoded(storage_ids))
+    dest_storage_id = db.Column(DictionaryEncoded(storage_ids))
 
     created_on = db.Column(db.DateTime, server_default=db.func.now())
     updated_on = db.Column(
@@ -81,7 +152,8 @@ class CatalogueArchiveItem(db.Model):
     """
 
     __tablename__ = f"{TABLE_PREFIX}catalogue_archive_item"
-    uuid = db.Column(db.String, primary_key=True)
+    __table_args__ = {"info": {"sharded": True}}
+    uuid = db.Column(CompactUUID, primary_key=True)
     source_path = db.Column(db.String)
     destination_path = db.Column(db.String)
     content_length = db.Column(db.BIGINT)
@@ -93,7 +165,7 @@ class CatalogueArchiveItem(db.Model):
 
     transfer_id = db.Column(db.String)
     transfer_status = db.Column(
-        db.String, default=TransferStatus.NOT_STARTED.value, index=True
+        EnumCode(TransferStatus), default=TransferStatus.NOT_STARTED.value, index=True
     )
     transfer_checksum_value = db.Column(db.String, nullable=True)
     transfer_checksum_verification = db.Column(db.String(20), nullable=True)
@@ -102,12 +174,12 @@ class CatalogueArchiveItem(db.Model):
     transfer_source = db.Column(db.String, nullable=True)
     transfer_destination = db.Column(db.String, nullable=True)
 
-    sealed_state = db.Column(db.String, index=True)
+    sealed_state = db.Column(EnumCode(SealedStatus), index=True)
     unseal_time = db.Column(db.DateTime, nullable=True)
     unseal_expiry_time = db.Column(db.DateTime, nullable=True)
 
-    source_storage_id = db.Column(db.String, index=True)
-    dest_storage_id = db.Column(db.String, index=True)
+    source_storage_id = db.Column(DictionaryEncoded(storage_ids), index=True)
+    dest_storage_id = db.Column(DictionaryEncoded(storage_ids), index=True)
 
     created_on = db.Column(db.DateTime, server_default=db.func.now())
     updated_on = db.Column(
@@ -138,7 +210,7 @@ class CatalogueTransferTracker(db.Model):
     """
 
     __tablename__ = f"{TABLE_PREFIX}catalogue_transfer_tracker"
-    uuid = db.Column(db.String, primary_key=True)
+    uuid = db.Column(CompactUUID, primary_key=True)
     flow_name = db.Column(db.String)
     source_storage_id = db.Column(db.String)
     destination_storage_id = db.Column(db.String)
@@ -166,3 +238,100 @@ class CatalogueTransferTracker(db.Model):
             if hasattr(self, k):
                 setattr(self, k, v)
                 self.updated_on = datetime.now()
+
+
+class CatalogueParquetFile(db.Model):
+
+    """
+    This table keeps track of the parquet files holding offloaded archive items
+    along with per-file statistics used to skip files while searching.
+
+    """
+
+    __tablename__ = f"{TABLE_PREFIX}parquet_file"
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String, unique=True, nullable=False)
+    source_storage_id = db.Column(db.String, index=True)
+    row_count = db.Column(db.BIGINT)
+    min_uuid = db.Column(db.String)
+    max_uuid = db.Column(db.String)
+    min_ingestion_date = db.Column(db.DateTime)
+    max_ingestion_date = db.Column(db.DateTime)
+    min_content_date_start = db.Column(db.DateTime)
+    max_content_date_start = db.Column(db.DateTime)
+
+    created_on = db.Column(db.DateTime, server_default=db.func.now())
+
+
+class CatalogueParquetUuidIndex(db.Model):
+
+    """
+    This table maps each offloaded archive item uuid to its parquet file
+
+    """
+
+    __tablename__ = f"{TABLE_PREFIX}parquet_uuid_index"
+    uuid = db.Column(CompactUUID, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey(CatalogueParquetFile.id), index=True)
+
+
+class CatalogueUploadManifest(db.Model):
+
+    """
+    This table keeps track of the uploaded csv/zip manifests by their content
+    (sha256) hash, so an identical manifest isn't ingested twice.
+
+    """
+
+    __tablename__ = f"{TABLE_PREFIX}upload_manifest"
+    content_hash = db.Column(db.String(64), primary_key=True)
+    upload_id = db.Column(db.String)
+    filename = db.Column(db.String)
+    size = db.Column(db.BIGINT)
+    status = db.Column(db.String)
+    added_count = db.Column(db.BIGINT)
+    failed_count = db.Column(db.BIGINT)
+
+    created_on = db.Column(db.DateTime, server_default=db.func.now())
+    updated_on = db.Column(
+        db.DateTime, server_default=db.func.now(), server_onupdate=db.func.now()
+    )
+
+    def update(self, data: dict) -> None:
+        """
+        Update through external dict.
+        """
+        if not data:
+            return
+        data = data.copy()
+        data.pop("content_hash", None)
+        data.pop("created_on", None)
+        data.pop("updated_on", None)
+
+        for k, v in data.items():
+            if hasattr(self, k):
+                setattr(self, k, v)
+                self.updated_on = datetime.now()
+
+
+class CatalogueThroughputRollup(db.Model):
+
+    """
+    Transfers reaching COMPLETED/FAILED aggregated per time bucket (of
+    `granularity`), storage pair and status, with one row per transfer
+    duration histogram bin (see `services.throughput`).
+
+    """
+
+    __tablename__ = f"{TABLE_PREFIX}throughput_rollup"
+    granularity = db.Column(db.String(10), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    source_storage_id = db.Column(db.String, primary_key=True)
+    dest_storage_id = db.Column(db.String, primary_key=True)
+    transfer_status = db.Column(db.String(20), primary_key=True)
+    # -1 when the transfer duration is unknown
+    duration_bin = db.Column(db.SmallInteger, primary_key=True)
+
+    files = db.Column(db.BIGINT, nullable=False, default=0)
+    bytes = db.Column(db.BIGINT, nullable=False, default=0)
+    duration_ms_sum = db.Column(db.BIGINT, nullable=False, default=0)
@@ -0,0 +1,262 @@
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional
+
+from flask import Flask, current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from loguru import logger
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import make_url
+
+from .background import LazyThread
+from .shards import (
+    ShardRoutingError,
+    current_shard,
+    is_sharded_table,
+    sharding_enabled,
+    statement_tables,
+)
+
+REPLICA_BIND_PREFIX = "replica_"
+
+READ_METHODS = ("GET", "HEAD")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+# a lag measurement older than this many checks is ignored
+STALE_LAG_CHECKS = 3
+
+# lag is 0 when the server isn't a standby or has replayed everything it received
+POSTGRES_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class RoutingSession(Session):
+    """
+    Session that sends plain SELECTs to the read replica chosen
+    for the current request (see `ReplicaRouter`).
+
+    Flushes, writes and models bound to a non-default bind always use
+    the regular flask-sqlalchemy bind resolution.
+
+    Statements on sharded tables go to the shard selected for the current
+    context (see `shards.ShardRouter`), replicas aren't used for them.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and sharding_enabled():
+            tables = statement_tables(mapper, clause)
+            if any(is_sharded_table(table) for table in tables):
+                shard = current_shard()
+                if shard is None:
+                    raise ShardRoutingError(
+                        f"No shard selected for a statement on {[t.name for t in tables]}"
+                    )
+                return self._db.engines[shard]
+        replica = _current_replica()
+        if (
+            replica is not None
+            and bind is None
+            and not self._flushing
+            and _is_default_bind_select(mapper, clause)
+        ):
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _current_replica() -> Optional[str]:
+    if not has_app_context():
+        return None
+    return g.get("db_replica")
+
+
+def _is_default_bind_select(mapper, clause) -> bool:
+    if clause is None or not getattr(clause, "is_select", False):
+        return False
+    if mapper is not None:
+        table = inspect(mapper).persist_selectable
+        metadata = getattr(table, "metadata", None)
+        if metadata is not None and metadata.info.get("bind_key") is not None:
+            return False
+    return True
+
+
+class ReplicaRouter:
+    """
+    Routes the read-only endpoints to read replicas.
+
+    - replicas are configured as extra `SQLALCHEMY_BINDS` named `replica_<n>`
+    - a replica whose lag exceeds `max_lag_seconds` (or can't be checked)
+      is skipped, falling back to the primary
+    - the lag is measured by a background thread every `lag_check_seconds`,
+      requests only read the last measurement so an unreachable replica
+      never blocks them
+    - a client that wrote within `read_your_writes_seconds` keeps reading
+      from the primary so it sees its own writes
+    """
+
+    def __init__(
+        self,
+        db,
+        max_lag_seconds: float = 5,
+        lag_check_seconds: float = 2,
+        read_your_writes_seconds: float = 10,
+        connect_timeout_seconds: int = 2,
+    ):
+        self.db = db
+        self.app = None
+        self.connect_timeout_seconds = connect_timeout_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.replica_keys: List[str] = []
+        self._lag_cache: Dict[str, tuple] = {}
+        self._last_writes: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._round_robin = None
+        self._monitor = LazyThread(self._monitor_lags, "replica-lag")
+
+    def init_app(self, app: Flask, replica_uris: List[str]) -> None:
+        """
+        Register the replica binds and the request hooks.
+        Needs to be called before `db.init_app(app)`.
+        """
+        self.app = app
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        self.replica_keys = []
+        for idx, uri in enumerate(replica_uris):
+            key = f"{REPLICA_BIND_PREFIX}{idx}"
+            binds[key] = dict(
+                url=uri, connect_args=_connect_args(uri, self.connect_timeout_seconds)
+            )
+            self.replica_keys.append(key)
+        self._round_robin = itertools.cycle(self.replica_keys)
+        logger.info(f"Configured {len(self.replica_keys)} read replica(s)")
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def replica_lag(self, key: str) -> Optional[float]:
+        """
+        Last measured replication lag of the replica in seconds. None if the
+        replica can't be reached or wasn't measured recently (eg: the monitor
+        is stuck connecting to it).
+        """
+        cached = self._lag_cache.get(key)
+        if not cached:
+            return None
+        max_age = STALE_LAG_CHECKS * self.lag_check_seconds + self.connect_timeout_seconds
+        if time.monotonic() - cached[0] > max_age:
+            return None
+        return cached[1]
+
+    def check_lag(self, key: str) -> Optional[float]:
+        lag = None
+        try:
+            engine = self.db.engines[key]
+            with engine.connect() as conn:
+                if engine.dialect.name == "postgresql":
+                    lag = float(conn.execute(text(POSTGRES_LAG_QUERY)).scalar() or 0)
+                else:
+                    # no replication info (eg: local sqlite copies), only check liveness
+                    conn.execute(text("SELECT 1"))
+                    lag = 0.0
+        except Exception:
+            logger.warning(f"Unable to check replication lag for bind={key}")
+        return lag
+
+    def _monitor_lags(self) -> None:
+        while True:
+            with self.app.app_context():
+                for key in self.replica_keys:
+                    self._lag_cache[key] = (time.monotonic(), self.check_lag(key))
+            time.sleep(self.lag_check_seconds)
+
+    def choose_replica(self) -> Optional[str]:
+        """
+        Pick the next healthy replica (round robin), None to use the primary.
+        """
+        for _ in range(len(self.replica_keys)):
+            with self._lock:
+                key = next(self._round_robin)
+            lag = self.replica_lag(key)
+            if lag is not None and lag <= self.max_lag_seconds:
+                return key
+            logger.debug(f"Skipping replica={key} with lag={lag}")
+        return None
+
+    def mark_write(self, client_id: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._last_writes[client_id] = now
+            if len(self._last_writes) > 10000:
+                self._last_writes = {
+                    cid: ts
+                    for cid, ts in self._last_writes.items()
+                    if now - ts < self.read_your_writes_seconds
+                }
+
+    def recently_wrote(self, client_id: str) -> bool:
+        ts = self._last_writes.get(client_id)
+        return ts is not None and time.monotonic() - ts < self.read_your_writes_seconds
+
+    @staticmethod
+    def read_only(view):
+        """
+        Mark a view which doesn't write (eg: a POST lookup) so it's routed
+        like a GET: served by a replica, and not counted as a write.
+        """
+        view.db_read_only = True
+        return view
+
+    @staticmethod
+    def is_read_request() -> bool:
+        if request.method in READ_METHODS:
+            return True
+        view = current_app.view_functions.get(request.endpoint)
+        return getattr(view, "db_read_only", False)
+
+    def _before_request(self) -> None:
+        g.db_replica = None
+        if not self.replica_keys or not self.is_read_request():
+            return
+        if self.recently_wrote(client_id()):
+            return
+        self._monitor.ensure_started()
+        g.db_replica = self.choose_replica()
+
+    def _after_request(self, response):
+        if (
+            request.method in WRITE_METHODS
+            and response.status_code < 400
+            and not self.is_read_request()
+        ):
+            self.mark_write(client_id())
+        if self.replica_keys:
+            response.headers["X-DB-Bind"] = g.get("db_replica") or "primary"
+        return response
+
+
+def _connect_args(uri: str, timeout: int) -> dict:
+    if make_url(uri).get_backend_name() in ("postgresql", "mysql"):
+        return {"connect_timeout": timeout}
+    return {}
+
+
+def client_id() -> str:
+    """
+    Identify the client for read-your-writes stickiness.
+    Clients can pin themselves with a `X-Client-Id` header.
+    """
+    cid = request.headers.get("X-Client-Id")
+    if cid:
+        return cid
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.remote_addr or ""
@@ -1,6 +1,6 @@
 from marshmallow_sqlalchemy import SQLAlchemySchema, auto_field, fields
 
-from .models import CatalogueItem, CatalogueTransferTracker
+from .models import CatalogueItem, CatalogueTransferTracker, CatalogueUploadManifest
 
 
 class CatalogueItemSchema(SQLAlchemySchema):
@@ -60,4 +60,24 @@ class CatalogueTransferTrackerSchema(SQLAlchemySchema):
     total_capacity = fields.fields.Integer()
     created_on = fields.fields.String()
     updated_on = fields.fields.String()
-    
\ No newline at end of file
+    
+
+class CatalogueUploadManifestSchema(SQLAlchemySchema):
+
+    """
+    This is used for serialization
+    """
+
+    class Meta:
+        model = CatalogueUploadManifest
+        load_instance = True
+
+    content_hash = auto_field()
+    upload_id = fields.fields.String()
+    filename = fields.fields.String()
+    size = fields.fields.Integer()
+    status = fields.fields.String()
+    added_count = fields.fields.Integer()
+    failed_count = fields.fields.Integer()
+    created_on = fields.fields.String()
+    updated_on = fields.fields.String()
@@ -0,0 +1,317 @@
+"""
+Optional horizontal sharding of the catalogue by `source_storage_id`.
+
+With `DB_SHARD_URIS` set, the tables flagged as sharded (`info={"sharded": True}`:
+`CatalogueItem`, `CatalogueArchiveItem`) live in one database per shard (binds
+`shard_<n>`); every other table (manifests, rollups, storage id dictionary...)
+stays in the default database.
+
+- a container is mapped to a shard by a consistent hash ring, so adding a
+  shard only moves ~1/n of the containers (see `rebalance`)
+- the shard of the current request/app context is kept in `g.db_shard` and
+  used by `RoutingSession.get_bind` for the statements on sharded tables
+- operations spanning several containers scatter the work to the shards in
+  parallel (`ShardRouter.scatter`) and merge the results
+- items addressed by uuid only are located with a lookup on every shard
+- an update can't change the container of an item to one of another shard
+  (`check_update`), items are only moved by `rebalance`
+
+Without shards every helper falls back to the default database, so callers
+don't need a separate code path.
+
+    python -m src.services.db.shards rebalance [--dry-run]
+"""
+import argparse
+import bisect
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app, g, has_app_context
+from loguru import logger
+from sqlalchemy import delete, insert, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql.util import find_tables
+
+SHARD_BIND_PREFIX = "shard_"
+
+REBALANCE_CHUNK_SIZE = 10000
+
+
+class ShardRoutingError(RuntimeError):
+    pass
+
+
+def is_sharded_table(table) -> bool:
+    return bool(getattr(table, "info", {}).get("sharded"))
+
+
+def statement_tables(mapper, clause) -> list:
+    if mapper is not None:
+        return [inspect(mapper).persist_selectable]
+    if clause is None:
+        return []
+    table = getattr(clause, "table", None)
+    if table is not None:
+        return [table]
+    get_froms = getattr(clause, "get_final_froms", None)
+    tables = []
+    for from_ in get_froms() if get_froms else []:
+        tables += find_tables(from_)
+    return tables
+
+
+def current_shard() -> Optional[str]:
+    if not has_app_context():
+        return None
+    return g.get("db_shard")
+
+
+def sharding_enabled() -> bool:
+    return has_app_context() and bool(current_app.config.get("DB_SHARD_KEYS"))
+
+
+class HashRing:
+    """
+    Consistent hash ring with `vnodes` virtual nodes per shard.
+    """
+
+    def __init__(self, keys: List[str], vnodes: int = 64):
+        self.points = sorted(
+            (self._hash(f"{key}#{idx}"), key) for key in keys for idx in range(vnodes)
+        )
+        self._hashes = [point for point, _ in self.points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+    def node(self, value: str) -> str:
+        idx = bisect.bisect(self._hashes, self._hash(value)) % len(self.points)
+        return self.points[idx][1]
+
+
+class ShardRouter:
+    def __init__(self):
+        self.db = None
+        self.app = None
+        self.shard_keys: List[str] = []
+        self.ring = None
+        self._pool = None
+
+    def init_app(
+        self, app, db, shard_uris: List[str], vnodes: int = 64, workers: int = 8
+    ) -> None:
+        """
+        Register the shard binds, needs to be called before `db.init_app(app)`.
+        `workers` threads run the scatter-gather queries.
+        """
+        self.app, self.db = app, db
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        self.shard_keys = []
+        for idx, uri in enumerate(shard_uris):
+            key = f"{SHARD_BIND_PREFIX}{idx}"
+            binds[key] = uri
+            self.shard_keys.append(key)
+        app.config["DB_SHARD_KEYS"] = list(self.shard_keys)
+        if self.shard_keys:
+            self.ring = HashRing(self.shard_keys, vnodes)
+            self._pool = ThreadPoolExecutor(workers, thread_name_prefix="shard")
+        logger.info(f"Configured {len(self.shard_keys)} shard(s)")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.shard_keys)
+
+    def sharded_tables(self) -> list:
+        return [table for table in self.db.metadata.sorted_tables if is_sharded_table(table)]
+
+    def create_all(self) -> None:
+        for key in self.shard_keys:
+            self.db.metadata.create_all(self.db.engines[key], tables=self.sharded_tables())
+
+    def shard_for(self, container: Optional[str]) -> Optional[str]:
+        if not self.enabled:
+            return None
+        return self.ring.node(container or "")
+
+    def shards_for(self, containers: Optional[Iterable[str]] = None) -> List[Optional[str]]:
+        """
+        Shards holding the containers (every shard if None).
+        """
+        if not self.enabled:
+            return [None]
+        if containers is None:
+            return list(self.shard_keys)
+        return sorted({self.shard_for(container) for container in containers})
+
+    def model_shards(self, model) -> List[Optional[str]]:
+        """
+        Shards holding the rows of `model` ([None] for the default database).
+        """
+        return self.shards_for() if is_sharded_table(model.__table__) else [None]
+
+    def select(self, shard: Optional[str]) -> None:
+        """
+        Use the shard for the rest of the request.
+        """
+        if self.enabled:
+            g.db_shard = shard
+
+    @contextmanager
+    def use(self, shard: Optional[str]):
+        previous = g.get("db_shard")
+        self.select(shard)
+        try:
+            yield
+        finally:
+            if self.enabled:
+                g.db_shard = previous
+
+    def scatter(
+        self, func: Callable, shards: Optional[List[Optional[str]]] = None
+    ) -> List[Tuple[Optional[str], object]]:
+        """
+        Run `func(shard)` on each shard, returning (shard, result) pairs.
+
+        A single shard runs in the current context. Several run in parallel,
+        each in its own app context (and session), so `func` can't use the
+        request and has to return plain data (eg: dumped items).
+        """
+        shards = self.shards_for() if shards is None else shards
+        if not shards:
+            return []
+        if len(shards) == 1:
+            with self.use(shards[0]):
+                return [(shards[0], func(shards[0]))]
+
+        def run(shard):
+            with self.app.app_context():
+                self.select(shard)
+                return func(shard)
+
+        futures = [(shard, self._pool.submit(run, shard)) for shard in shards]
+        return [(shard, future.result()) for shard, future in futures]
+
+    def locate(self, model, uuids: List[str]) -> Dict[Optional[str], List[str]]:
+        """
+        Shard -> uuids of `model` found there (looked up on every shard).
+        """
+
+        def find(shard):
+            return (
+                self.db.session.execute(select(model.uuid).where(model.uuid.in_(uuids)))
+                .scalars()
+                .all()
+            )
+
+        located = self.scatter(find, self.model_shards(model))
+        return {shard: found for shard, found in located if found}
+
+    def route(self, model, uuids: List[str]) -> Dict[Optional[str], List[str]]:
+        """
+        Like `locate`, but without the lookup when the items can only be in a
+        single database: every uuid is then returned (existing or not).
+        """
+        if not self.enabled or not is_sharded_table(model.__table__):
+            return {None: list(uuids)} if uuids else {}
+        return self.locate(model, uuids)
+
+    def check_update(self, model, shard: Optional[str], data: dict) -> None:
+        """
+        Raise `ShardRoutingError` when `data` would move an item stored on
+        `shard` to a container of another shard, the item would be left on
+        the wrong shard.
+        """
+        if (
+            self.enabled
+            and is_sharded_table(model.__table__)
+            and "source_storage_id" in data
+            and self.shard_for(data["source_storage_id"]) != shard
+        ):
+            raise ShardRoutingError(
+                "source_storage_id can't be changed to a container of another shard!"
+            )
+
+    def rebalance(
+        self, dry_run: bool = False, chunk_size: int = REBALANCE_CHUNK_SIZE
+    ) -> dict:
+        """
+        Move the containers stored on a shard other than the one the ring maps
+        them to (eg: after adding a shard). Rows are copied then deleted chunk by
+        chunk, so an interrupted rebalance can be run again.
+        """
+        moved = {}
+        for shard in self.shard_keys:
+            for table in self.sharded_tables():
+                with self.db.engines[shard].connect() as conn:
+                    containers = conn.execute(
+                        select(table.c.source_storage_id).distinct()
+                    ).scalars().all()
+                for container in containers:
+                    target = self.shard_for(container)
+                    if target == shard:
+                        continue
+                    logger.info(f"{table.name}: {container} {shard} -> {target}")
+                    count = 0
+                    if not dry_run:
+                        count = self._move(table, container, shard, target, chunk_size)
+                    moved.setdefault(table.name, {})[container] = dict(
+                        source=shard, target=target, rows=count
+                    )
+        return moved
+
+    def _move(self, table, container, source: str, target: str, chunk_size: int) -> int:
+        source_engine, target_engine = self.db.engines[source], self.db.engines[target]
+        dialect = target_engine.dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            insert_ = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(
+                table
+            ).on_conflict_do_nothing(index_elements=["uuid"])
+        else:
+            insert_ = insert(table)
+        total = 0
+        while True:
+            with source_engine.connect() as conn:
+                rows = [
+                    dict(row._mapping)
+                    for row in conn.execute(
+                        select(table)
+                        .where(table.c.source_storage_id == container)
+                        .order_by(table.c.uuid)
+                        .limit(chunk_size)
+                    )
+                ]
+            if not rows:
+                return total
+            with target_engine.begin() as conn:
+                conn.execute(insert_, rows)
+            with source_engine.begin() as conn:
+                conn.execute(
+                    delete(table).where(table.c.uuid.in_([row["uuid"] for row in rows]))
+                )
+            total += len(rows)
+
+
+shard_router = ShardRouter()
+
+
+def main():
+    from src.app import app, shard_router
+
+    parser = argparse.ArgumentParser(description="Catalogue shards.")
+    parser.add_argument("command", choices=["rebalance"])
+    parser.add_argument("--dry-run", action="store_true", help="only log the moves")
+    parser.add_argument("--chunk-size", type=int, default=REBALANCE_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    if not shard_router.enabled:
+        raise SystemExit("Sharding isn't configured (DB_SHARD_URIS).")
+    with app.app_context():
+        moved = shard_router.rebalance(dry_run=args.dry_run, chunk_size=args.chunk_size)
+    logger.info(f"Moved: {moved}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Column types for the opt-in compact schema (`DB_COMPACT_SCHEMA`).
+
+With the compact schema disabled every type here behaves like a plain
+`String` column. Enabled, the values are stored as:
+    - `CompactUUID`: native `uuid` on postgresql, 16 raw bytes elsewhere
+    - `EnumCode`: smallint code of the enum member
+    - `DictionaryEncoded`: integer id from a value dictionary table
+
+The api keeps sending/receiving strings; ids come back in their
+canonical dashed form whatever form (hex/dashed) was sent.
+"""
+import os
+import threading
+import uuid
+from enum import Enum
+from typing import Dict, Optional, Type
+
+from sqlalchemy import Integer, LargeBinary, SmallInteger, String, insert, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.types import TypeDecorator
+
+from src.config import CONFIG_BY_ENV
+
+CFG = CONFIG_BY_ENV[os.getenv("FLASK_ENV", "local")]
+
+COMPACT_SCHEMA = CFG.DB_COMPACT_SCHEMA
+
+# code compared against for the values missing from a dictionary (ids start at 1)
+UNKNOWN_CODE = -1
+
+
+def normalize_id(value):
+    """
+    Canonical form of an id at the api boundary.
+    Raises ValueError for an invalid uuid when the compact schema is enabled.
+    """
+    if not COMPACT_SCHEMA or value is None:
+        return value
+    return str(uuid.UUID(str(value)))
+
+
+def is_valid_id(value) -> bool:
+    try:
+        normalize_id(value)
+    except ValueError:
+        return False
+    return True
+
+
+class CompactUUID(TypeDecorator):
+    impl = String
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if not COMPACT_SCHEMA:
+            return dialect.type_descriptor(String())
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if not COMPACT_SCHEMA or value is None:
+            return value
+        value = value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+        return value if dialect.name == "postgresql" else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if not COMPACT_SCHEMA or value is None:
+            return value
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        return str(uuid.UUID(bytes=bytes(value)))
+
+
+class EnumCode(TypeDecorator):
+    """
+    Stores the declaration index of an enum member.
+    New members must be appended to the enum to keep the codes stable.
+    """
+
+    impl = String
+    cache_ok = True
+
+    def __init__(self, enum_class: Type[Enum], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.enum_class = enum_class
+        self.codes = {member.value: code for code, member in enumerate(enum_class)}
+        self.values = {code: value for value, code in self.codes.items()}
+
+    def load_dialect_impl(self, dialect):
+        if not COMPACT_SCHEMA:
+            return dialect.type_descriptor(String())
+        return dialect.type_descriptor(SmallInteger())
+
+    def process_bind_param(self, value, dialect):
+        if not COMPACT_SCHEMA or value is None:
+            return value
+        value = value.value if isinstance(value, Enum) else value
+        if value not in self.codes:
+            raise ValueError(f"Invalid {self.enum_class.__name__} value: {value}")
+        return self.codes[value]
+
+    def process_result_value(self, value, dialect):
+        if not COMPACT_SCHEMA or value is None:
+            return value
+        return self.values[value]
+
+
+class StringDictionary:
+    """
+    Two-way cache of a (id, value) dictionary table.
+
+    Unknown values are added to the table on first write through a separate
+    connection, so the codes are shared by every process and table. Values
+    only compared against (filters) are looked up without being added.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.db = None
+        self._codes: Dict[str, int] = {}
+        self._values: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def init_db(self, db) -> None:
+        self.db = db
+
+    def _cache(self, code: int, value: str) -> int:
+        self._codes[value] = code
+        self._values[code] = value
+        return code
+
+    def _fetch(self, conn, column, value) -> Optional[tuple]:
+        return conn.execute(
+            select(self.table.c.id, self.table.c.value).where(column == value)
+        ).first()
+
+    def code(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is not None:
+            return code
+        with self._lock:
+            try:
+                with self.db.engine.begin() as conn:
+                    row = self._fetch(conn, self.table.c.value, value)
+                    if row is None:
+                        conn.execute(insert(self.table).values(value=value))
+                        row = self._fetch(conn, self.table.c.value, value)
+            except IntegrityError:
+                # added concurrently by another process
+                with self.db.engine.connect() as conn:
+                    row = self._fetch(conn, self.table.c.value, value)
+            return self._cache(row.id, row.value)
+
+    def lookup(self, value: str) -> Optional[int]:
+        """
+        Code of the value, None if it isn't in the dictionary.
+        """
+        code = self._codes.get(value)
+        if code is not None:
+            return code
+        with self.db.engine.connect() as conn:
+            row = self._fetch(conn, self.table.c.value, value)
+        return None if row is None else self._cache(row.id, row.value)
+
+    def value(self, code: int) -> str:
+        value = self._values.get(code)
+        if value is not None:
+            return value
+        with self.db.engine.connect() as conn:
+            row = self._fetch(conn, self.table.c.id, code)
+        if row is None:
+            raise ValueError(f"Unknown dictionary code: {code}")
+        self._cache(row.id, row.value)
+        return row.value
+
+
+class DictionaryEncoded(TypeDecorator):
+    impl = String
+    cache_ok = True
+
+    def __init__(self, dictionary: StringDictionary, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dictionary = dictionary
+
+    def load_dialect_impl(self, dialect):
+        if not COMPACT_SCHEMA:
+            return dialect.type_descriptor(String())
+        return dialect.type_descriptor(Integer())
+
+    def process_bind_param(self, value, dialect):
+        if not COMPACT_SCHEMA or value is None:
+            return value
+        return self.dictionary.code(str(value))
+
+    def process_result_value(self, value, dialect):
+        if not COMPACT_SCHEMA or value is None:
+            return value
+        return self.dictionary.value(value)
+
+    def coerce_compared_value(self, op, value):
+        # values compared against (filters) mustn't grow the dictionary
+        return DictionaryLookup(self.dictionary)
+
+
+class DictionaryLookup(DictionaryEncoded):
+    """
+    Type of the values compared against a `DictionaryEncoded` column:
+    an unknown value is bound as `UNKNOWN_CODE`, which matches nothing.
+    """
+
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if not COMPACT_SCHEMA or value is None:
+            return value
+        code = self.dictionary.lookup(str(value))
+        return UNKNOWN_CODE if code is None else code
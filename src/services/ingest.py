@@ -0,0 +1,334 @@
+"""
+Loading of the catalogue csv/zip manifests into the `CatalogueItem` table.
+
+Ingested manifests are recorded by their content hash in
+`CatalogueUploadManifest`, so uploading an identical file again is skipped.
+
+The csv members of a zip are parsed in parallel by a process pool and
+loaded one batch at a time; results are reported per member.
+"""
+import hashlib
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from typing import BinaryIO, Iterable, List, Tuple
+
+import pandas as pd
+from loguru import logger
+from sqlalchemy.exc import IntegrityError
+
+import src.constants as CONSTANTS
+from src.config import CONFIG_BY_ENV
+from src.services.db.enums import ManifestStatus
+from src.services.db.models import CatalogueItem, CatalogueUploadManifest, db
+from src.services.db.schema import CatalogueUploadManifestSchema
+from src.services.db.shards import shard_router
+from src.services.db.types import normalize_id
+
+ERROR_MSG_ANY_OF_THE_CATALOGUE_POST_MANDATORY_FIELDS_EMPTY = (
+    "Any of the column "
+    + ",".join(CONSTANTS.CATALOGUE_POST_MANDATORY_FIELDS)
+    + "values are empty!"
+)
+
+CFG = CONFIG_BY_ENV[os.getenv("FLASK_ENV", "local")]
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+INGEST_WORKERS = CFG.INGEST_WORKERS
+
+INGEST_STALE_SECONDS = CFG.INGEST_STALE_SECONDS
+
+
+class IngestError(Exception):
+    def __init__(self, error: str, message: str = "", status_code: int = 400):
+        super().__init__(message or error)
+        self.error = error
+        self.message = message
+        self.status_code = status_code
+
+
+def copy_with_hash(sources: Iterable[BinaryIO], dest: BinaryIO) -> Tuple[str, int]:
+    """
+    Stream the sources into dest, returning the sha256 hex digest and size.
+    """
+    sha256, size = hashlib.sha256(), 0
+    for source in sources:
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b""):
+            sha256.update(block)
+            dest.write(block)
+            size += len(block)
+    return sha256.hexdigest(), size
+
+
+def file_hash(fpath: str) -> Tuple[str, int]:
+    sha256, size = hashlib.sha256(), 0
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            sha256.update(block)
+            size += len(block)
+    return sha256.hexdigest(), size
+
+
+def load_catalogue_file(fpath) -> pd.DataFrame:
+    """
+    Load and validate a csv manifest (path or file object) into a dataframe
+    of `CatalogueItem` columns.
+    """
+    try:
+        data = pd.read_csv(fpath)
+    except:
+        logger.error("Failed to load csv")
+        raise IngestError("INVALID_FILE")
+
+    try:
+        data.rename(
+            columns=CONSTANTS.CATALOGUE_CSV_COLUMN_MAPPER, inplace=True, errors="raise"
+        )
+    except:
+        logger.error("Some columns are missing or improper column name.")
+        raise IngestError(
+            "UPLOAD_FAILED", "Invalid columns or some columns are missing!"
+        )
+
+    # make sure these columns aren't empty
+    if data[CONSTANTS.CATALOGUE_POST_MANDATORY_FIELDS].isna().sum().sum() > 0:
+        logger.error(ERROR_MSG_ANY_OF_THE_CATALOGUE_POST_MANDATORY_FIELDS_EMPTY)
+        raise IngestError(
+            "UPLOAD_FAILED", ERROR_MSG_ANY_OF_THE_CATALOGUE_POST_MANDATORY_FIELDS_EMPTY
+        )
+
+    # in case content end date is missing, fill it up with start date
+    data["content_date_end"].fillna(data["content_date_start"], inplace=True)
+    try:
+        data["content_date_start"] = pd.to_datetime(data["content_date_start"])
+        data["content_date_end"] = pd.to_datetime(data["content_date_end"])
+        data["ingestion_date"] = pd.to_datetime(data["ingestion_date"])
+    except:
+        logger.error(
+            "Date time conversion failed for content_date_start and content_date_end columns! Aborting..."
+        )
+        raise IngestError("UPLOAD_FAILED", "Invalid ingestion/content-start date!")
+
+    # add transfer columns
+    data["transfer_id"] = ""
+    data["transfer_status"] = "NOT_STARTED"
+    data["transfer_checksum_value"] = ""
+    data["transfer_checksum_verification"] = ""
+    data["transfer_started_on"] = CONSTANTS.DATETIME_OLDEST
+    data["transfer_completed_on"] = CONSTANTS.DATETIME_OLDEST
+    data["transfer_source"] = ""
+    data["transfer_destination"] = ""
+
+    data["sealed_state"] = data["sealed_state"].map(
+        CONSTANTS.CATALOGUE_SEALED_STATE_MAPPER
+    )
+
+    data["created_on"] = datetime.now()
+    data["updated_on"] = datetime.now()
+
+    try:
+        data["uuid"] = data["uuid"].map(normalize_id)
+    except ValueError:
+        raise IngestError("UPLOAD_FAILED", "Invalid Id values!")
+    return data
+
+
+def dump_catalogue_items(data: pd.DataFrame) -> dict:
+    """
+    Insert the rows whose uuid doesn't exist yet.
+    Returns the number of added rows and the (existing) uuids that failed.
+    """
+    uuids = list(data["uuid"])
+    items = list(map(lambda d: CatalogueItem(**d), data.to_dict("records")))
+
+    logger.debug(f"Dumping to table={CatalogueItem.__tablename__}")
+    try:
+        existing_uuids = {
+            uuid
+            for found in shard_router.locate(CatalogueItem, uuids).values()
+            for uuid in found
+        }
+
+        to_add_uuids = set(uuids) - existing_uuids
+        to_add_data = list(filter(lambda item: item.uuid in to_add_uuids, items))
+        # each shard gets the items of its containers
+        shard_items = {}
+        for item in to_add_data:
+            shard = shard_router.shard_for(item.source_storage_id)
+            shard_items.setdefault(shard, []).append(item)
+        for shard, to_add in shard_items.items():
+            with shard_router.use(shard):
+                db.session.add_all(to_add)
+                db.session.commit()
+    except:
+        db.session.rollback()
+        logger.error("CatalogueItem table upload failed")
+        raise IngestError("UPLOAD_FAILED", "Dumping to sql table failed!")
+
+    logger.debug(f"{len(to_add_data)}/{len(uuids)} data added.")
+    return dict(added=len(to_add_data), failed=list(existing_uuids))
+
+
+def zip_members(fpath: str) -> List[str]:
+    with zipfile.ZipFile(fpath) as zf:
+        members = [
+            info.filename
+            for info in zf.infolist()
+            if not info.is_dir()
+            and info.filename.lower().endswith(".csv")
+            and not os.path.basename(info.filename).startswith(".")
+            and not info.filename.startswith("__MACOSX/")
+        ]
+    if not members:
+        raise IngestError("INVALID_FILE", "No csv file in the zip!")
+    return members
+
+
+def parse_zip_member(fpath: str, member: str) -> dict:
+    """
+    Parse and validate a single csv member of a zip (runs in a worker process).
+    The rows are returned as columnar numpy arrays to keep the pickled batch compact.
+    """
+    try:
+        with zipfile.ZipFile(fpath) as zf, zf.open(member) as f:
+            data = load_catalogue_file(f)
+    except IngestError as e:
+        return dict(member=member, error=dict(error=e.error, message=e.message))
+    return dict(
+        member=member,
+        error=None,
+        columns={column: data[column].to_numpy() for column in data.columns},
+    )
+
+
+def ingest_zip_file(fpath: str) -> dict:
+    """
+    Parse the csv members of a zip in parallel (process pool) and load each
+    parsed batch into the table from this process as soon as it is ready.
+    """
+    members = zip_members(fpath)
+    results, added, failed = [], 0, []
+    workers = min(INGEST_WORKERS, len(members))
+    # spawn: the server process is multi-threaded, forking it isn't safe
+    with ProcessPoolExecutor(workers, mp_context=get_context("spawn")) as pool:
+        futures = [pool.submit(parse_zip_member, fpath, member) for member in members]
+        for future in as_completed(futures):
+            batch = future.result()
+            res = dict(member=batch["member"], added=0, failed_count=0, error=None)
+            try:
+                if batch["error"]:
+                    raise IngestError(**batch["error"])
+                dumped = dump_catalogue_items(pd.DataFrame(batch["columns"]))
+                res.update(added=dumped["added"], failed_count=len(dumped["failed"]))
+                added += dumped["added"]
+                failed += dumped["failed"]
+            except IngestError as e:
+                logger.error(f"Failed to ingest member={batch['member']}: {e.message}")
+                res["error"] = dict(error=e.error, message=e.message)
+            results.append(res)
+
+    if all(res["error"] for res in results):
+        raise IngestError(
+            "UPLOAD_FAILED",
+            "; ".join(f"{res['member']}: {res['error']['message']}" for res in results),
+        )
+    return dict(added=added, failed=failed, members=results)
+
+
+def _duplicate(manifest: CatalogueUploadManifest) -> dict:
+    return dict(
+        added=0,
+        failed=[],
+        duplicate=True,
+        manifest=CatalogueUploadManifestSchema().dump(manifest),
+    )
+
+
+def find_ingested_manifest(content_hash: str):
+    """
+    Manifest of the content if it was ingested or is being ingested. A manifest
+    INGESTING for more than `INGEST_STALE_SECONDS` (eg: the server died while
+    ingesting it) is considered failed.
+    """
+    manifest = db.session.get(CatalogueUploadManifest, content_hash)
+    if not manifest or manifest.status == ManifestStatus.FAILED.value:
+        return None
+    if manifest.status == ManifestStatus.INGESTING.value and (
+        manifest.updated_on is None
+        or datetime.now() - manifest.updated_on > timedelta(seconds=INGEST_STALE_SECONDS)
+    ):
+        logger.warning(f"Manifest {content_hash} stuck INGESTING since {manifest.updated_on}")
+        return None
+    return manifest
+
+
+def ingest_catalogue_file(
+    fpath: str,
+    filename: str,
+    upload_id: str = "",
+    force: bool = False,
+    content_hash: str = "",
+    size: int = 0,
+) -> dict:
+    """
+    Ingest a manifest file unless a file with the same content was already
+    ingested (or is being ingested). `force` ingests it again regardless.
+    The file is hashed unless its `content_hash` (and `size`) are given.
+
+    The manifest row is claimed (INGESTING) before loading so concurrent
+    uploads of the same content are only ingested once.
+    """
+    if not content_hash:
+        content_hash, size = file_hash(fpath)
+    manifest = db.session.get(CatalogueUploadManifest, content_hash)
+    if not force and find_ingested_manifest(content_hash):
+        logger.info(f"Manifest {content_hash} already {manifest.status}, skipping")
+        return _duplicate(manifest)
+
+    if not manifest:
+        manifest = CatalogueUploadManifest(content_hash=content_hash)
+        db.session.add(manifest)
+    manifest.update(
+        dict(
+            upload_id=upload_id,
+            filename=filename,
+            size=size,
+            status=ManifestStatus.INGESTING.value,
+        )
+    )
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return _duplicate(db.session.get(CatalogueUploadManifest, content_hash))
+
+    try:
+        if zipfile.is_zipfile(fpath):
+            res = ingest_zip_file(fpath)
+        else:
+            res = dump_catalogue_items(load_catalogue_file(fpath))
+    except Exception:
+        # any failure (worker crash, database error...) releases the manifest
+        db.session.rollback()
+        try:
+            manifest.update(dict(status=ManifestStatus.FAILED.value))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"Unable to mark manifest {content_hash} as FAILED")
+        raise
+
+    manifest.update(
+        dict(
+            status=ManifestStatus.INGESTED.value,
+            added_count=res["added"],
+            failed_count=len(res["failed"]),
+        )
+    )
+    db.session.commit()
+    return dict(
+        res, duplicate=False, manifest=CatalogueUploadManifestSchema().dump(manifest)
+    )
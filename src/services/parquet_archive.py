@@ -0,0 +1,280 @@
+"""
+Cold tier for the archived catalogue items.
+
+Archived containers are offloaded from the `CatalogueArchiveItem` table to
+compressed parquet files partitioned by container:
+
+    <ARCHIVE_PARQUET_URI>/source_storage_id=<container>/part-<timestamp>.parquet
+
+Rows are written sorted by uuid so each row group covers a narrow uuid range.
+Every file is registered in `CatalogueParquetFile` (with min/max statistics used
+to skip files while searching) and every uuid in `CatalogueParquetUuidIndex`, so
+a uuid lookup opens a single file and reads a single row group.
+
+    python -m src.services.parquet_archive [--container <container>]
+"""
+import argparse
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from loguru import logger
+from sqlalchemy import delete, insert, or_, select
+
+from src.services.db.filters import normalize_filters
+from src.services.db.models import (
+    CatalogueArchiveItem,
+    CatalogueParquetFile,
+    CatalogueParquetUuidIndex,
+    db,
+)
+from src.services.db.shards import shard_router
+from src.services.db.types import normalize_id
+
+ARROW_TYPES = {int: pa.int64(), datetime: pa.timestamp("us"), str: pa.string()}
+
+ARCHIVE_TABLE = CatalogueArchiveItem.__table__
+
+# compact schema types are exposed as strings (their `impl`)
+ARROW_SCHEMA = pa.schema(
+    [
+        (column.name, ARROW_TYPES[getattr(column.type, "impl", column.type).python_type])
+        for column in ARCHIVE_TABLE.columns
+    ]
+)
+
+# manifest columns used to skip files for a date range filter
+FILE_DATE_STATISTICS = {
+    "ingestion_date": (
+        CatalogueParquetFile.min_ingestion_date,
+        CatalogueParquetFile.max_ingestion_date,
+    ),
+    "content_date_start": (
+        CatalogueParquetFile.min_content_date_start,
+        CatalogueParquetFile.max_content_date_start,
+    ),
+}
+
+DELETE_CHUNK_SIZE = 10000
+
+
+def _min_max(rows: List[dict], column: str) -> tuple:
+    values = [row[column] for row in rows if row[column] is not None]
+    return (min(values), max(values)) if values else (None, None)
+
+
+class ParquetArchive:
+    def __init__(
+        self,
+        uri: str,
+        compression: str = "zstd",
+        file_rows: int = 1000000,
+        row_group_rows: int = 100000,
+    ):
+        # local paths need to be absolute for pyarrow
+        uri = uri if "://" in uri else os.path.abspath(uri)
+        self.filesystem, self.root = pafs.FileSystem.from_uri(uri)
+        self.compression = compression
+        self.file_rows = file_rows
+        self.row_group_rows = row_group_rows
+
+    def archived_containers(self) -> List[str]:
+        def containers(shard):
+            return (
+                db.session.execute(select(CatalogueArchiveItem.source_storage_id).distinct())
+                .scalars()
+                .all()
+            )
+
+        return sorted(
+            {container for _, found in shard_router.scatter(containers) for container in found}
+        )
+
+    def offload(self, container: str) -> Dict[str, int]:
+        """
+        Move every archived item of the container to parquet files.
+        Each file is committed (manifest, uuid index and archive deletion) on its own.
+        """
+        files, rows = 0, 0
+        with shard_router.use(shard_router.shard_for(container)):
+            while True:
+                written = self._offload_file(container)
+                if not written:
+                    break
+                files += 1
+                rows += written
+        logger.info(f"Offloaded {rows} archived items of {container} to {files} file(s)")
+        return dict(files=files, rows=rows)
+
+    def _offload_file(self, container: str) -> int:
+        directory = f"{self.root}/source_storage_id={quote(container, safe='')}"
+        path = f"{directory}/part-{datetime.now():%Y%m%dT%H%M%S%f}.parquet"
+
+        writer, rows, last_uuid = None, [], None
+        while len(rows) < self.file_rows:
+            query = (
+                select(ARCHIVE_TABLE)
+                .where(CatalogueArchiveItem.source_storage_id == container)
+                .order_by(CatalogueArchiveItem.uuid)
+                .limit(min(self.row_group_rows, self.file_rows - len(rows)))
+            )
+            if last_uuid is not None:
+                query = query.where(CatalogueArchiveItem.uuid > last_uuid)
+            chunk = [dict(row._mapping) for row in db.session.execute(query)]
+            if not chunk:
+                break
+            if writer is None:
+                self.filesystem.create_dir(directory, recursive=True)
+                writer = pq.ParquetWriter(
+                    path,
+                    ARROW_SCHEMA,
+                    filesystem=self.filesystem,
+                    compression=self.compression,
+                )
+            writer.write_table(pa.Table.from_pylist(chunk, schema=ARROW_SCHEMA))
+            rows += chunk
+            last_uuid = chunk[-1]["uuid"]
+        if writer is None:
+            return 0
+        writer.close()
+
+        # the file is only visible to lookups once registered
+        uuids = [row["uuid"] for row in rows]
+        min_ingestion, max_ingestion = _min_max(rows, "ingestion_date")
+        min_content, max_content = _min_max(rows, "content_date_start")
+        try:
+            file_id = db.session.execute(
+                insert(CatalogueParquetFile).values(
+                    path=path,
+                    source_storage_id=container,
+                    row_count=len(rows),
+                    min_uuid=min(uuids),
+                    max_uuid=max(uuids),
+                    min_ingestion_date=min_ingestion,
+                    max_ingestion_date=max_ingestion,
+                    min_content_date_start=min_content,
+                    max_content_date_start=max_content,
+                )
+            ).inserted_primary_key[0]
+            for idx in range(0, len(uuids), DELETE_CHUNK_SIZE):
+                chunk = uuids[idx : idx + DELETE_CHUNK_SIZE]
+                db.session.execute(
+                    insert(CatalogueParquetUuidIndex),
+                    [dict(uuid=uuid, file_id=file_id) for uuid in chunk],
+                )
+                db.session.execute(
+                    delete(CatalogueArchiveItem).where(
+                        CatalogueArchiveItem.uuid.in_(chunk)
+                    ),
+                    execution_options={"synchronize_session": False},
+                )
+            db.session.commit()
+        except:
+            db.session.rollback()
+            self.filesystem.delete_file(path)
+            raise
+        logger.debug(f"Offloaded {len(rows)} items to {path}")
+        return len(rows)
+
+    def lookup(self, uuid: str) -> Optional[dict]:
+        """
+        Find a single offloaded item using the uuid index and the row group statistics.
+        """
+        uuid = normalize_id(uuid)
+        path = db.session.execute(
+            select(CatalogueParquetFile.path)
+            .join(
+                CatalogueParquetUuidIndex,
+                CatalogueParquetUuidIndex.file_id == CatalogueParquetFile.id,
+            )
+            .where(CatalogueParquetUuidIndex.uuid == uuid)
+        ).scalar()
+        if not path:
+            return None
+
+        with self.filesystem.open_input_file(path) as f:
+            parquet_file = pq.ParquetFile(f)
+            metadata = parquet_file.metadata
+            uuid_idx = ARROW_SCHEMA.get_field_index("uuid")
+            for rg in range(metadata.num_row_groups):
+                stats = metadata.row_group(rg).column(uuid_idx).statistics
+                if stats is not None and stats.has_min_max:
+                    if not stats.min <= uuid <= stats.max:
+                        continue
+                table = parquet_file.read_row_group(rg)
+                rows = table.filter(pc.equal(table["uuid"], uuid)).to_pylist()
+                if rows:
+                    return rows[0]
+        return None
+
+    def search(self, filters: Dict[str, Any], limit: int) -> List[dict]:
+        """
+        Search the offloaded items with a filter dict (see `filters.normalize_filters`).
+        Files are skipped with the manifest statistics and row groups with the
+        parquet statistics.
+        """
+        filters = normalize_filters(filters)
+
+        query = select(CatalogueParquetFile.path)
+        if "source_storage_id" in filters:
+            query = query.where(
+                CatalogueParquetFile.source_storage_id.in_(filters["source_storage_id"])
+            )
+        for field, (min_column, max_column) in FILE_DATE_STATISTICS.items():
+            if field not in filters:
+                continue
+            if filters[field]["from"]:
+                query = query.where(
+                    or_(max_column.is_(None), max_column >= filters[field]["from"])
+                )
+            if filters[field]["to"]:
+                query = query.where(
+                    or_(min_column.is_(None), min_column < filters[field]["to"])
+                )
+        paths = db.session.execute(query.order_by(CatalogueParquetFile.id)).scalars().all()
+        if not paths or limit <= 0:
+            return []
+
+        expression = None
+        for field, value in filters.items():
+            if isinstance(value, dict):
+                arrow_type = ARROW_SCHEMA.field(field).type
+                clauses = []
+                if value["from"] is not None:
+                    clauses.append(ds.field(field) >= pa.scalar(value["from"], arrow_type))
+                if value["to"] is not None:
+                    clauses.append(ds.field(field) < pa.scalar(value["to"], arrow_type))
+            else:
+                clauses = [ds.field(field).isin(value)]
+            for clause in clauses:
+                expression = clause if expression is None else expression & clause
+
+        dataset = ds.dataset(
+            paths, schema=ARROW_SCHEMA, format="parquet", filesystem=self.filesystem
+        )
+        return dataset.head(limit, filter=expression).to_pylist()
+
+
+def main():
+    from src.app import app, parquet_archive
+
+    parser = argparse.ArgumentParser(description="Offload archived items to parquet.")
+    parser.add_argument("--container", help="defaults to every archived container")
+    args = parser.parse_args()
+
+    with app.app_context():
+        containers = (
+            [args.container] if args.container else parquet_archive.archived_containers()
+        )
+        for container in containers:
+            parquet_archive.offload(container)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Transfer throughput rollups.
+
+Every catalogue item reaching COMPLETED or FAILED is added to
+`CatalogueThroughputRollup` for each granularity (minute, hour): files, bytes
+and transfer duration per time bucket, storage pair and status. Durations are
+kept as a log-scale histogram (4 bins per doubling, ~19% wide) so the
+percentiles can be estimated without keeping every duration.
+
+The rollups are updated in the same transaction as the status change:
+    - ORM updates (single/bulk PATCH) through a `before_flush` listener
+    - set-based updates (transition, group commit) through `record_updates`
+
+Items which were already done before the rollups existed are added with:
+
+    python -m src.services.throughput --backfill [--reset]
+"""
+import argparse
+import math
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from dateutil import parser as dt_parser
+from loguru import logger
+from sqlalchemy import delete, event, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import src.constants as CONSTANTS
+from src.services.db.enums import TransferStatus
+from src.services.db.models import CatalogueItem, CatalogueThroughputRollup
+from src.services.db.shards import shard_router
+
+ROLLUP_TABLE = CatalogueThroughputRollup.__table__
+
+# granularity -> bucket size in seconds
+GRANULARITIES = OrderedDict(minute=60, hour=3600)
+
+TERMINAL_STATUSES = (TransferStatus.COMPLETED.value, TransferStatus.FAILED.value)
+
+BINS_PER_DOUBLING = 4
+
+UNKNOWN_DURATION_BIN = -1
+
+ROLLUP_KEY = (
+    "granularity",
+    "bucket_start",
+    "source_storage_id",
+    "dest_storage_id",
+    "transfer_status",
+    "duration_bin",
+)
+
+ROLLUP_COUNTERS = ("files", "bytes", "duration_ms_sum")
+
+# item columns needed to roll an item up
+ITEM_COLUMNS = (
+    "uuid",
+    "source_storage_id",
+    "dest_storage_id",
+    "transfer_status",
+    "transfer_started_on",
+    "transfer_completed_on",
+    "content_length",
+    "updated_on",
+)
+
+BACKFILL_CHUNK_SIZE = 10000
+
+
+def duration_bin(duration_ms: Optional[float]) -> int:
+    if duration_ms is None or duration_ms < 0:
+        return UNKNOWN_DURATION_BIN
+    if duration_ms < 1:
+        return 0
+    return int(math.floor(math.log2(duration_ms) * BINS_PER_DOUBLING)) + 1
+
+
+def bin_bounds(duration_bin: int) -> tuple:
+    """
+    [lower, upper) duration in ms covered by a histogram bin.
+    """
+    if duration_bin == 0:
+        return 0.0, 1.0
+    return (
+        2 ** ((duration_bin - 1) / BINS_PER_DOUBLING),
+        2 ** (duration_bin / BINS_PER_DOUBLING),
+    )
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    # patched values may still be the strings sent by the client
+    if isinstance(value, str):
+        try:
+            value = dt_parser.parse(value)
+        except (ValueError, OverflowError):
+            return None
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value if isinstance(value, datetime) else None
+
+
+def _is_set(value: Optional[datetime]) -> bool:
+    # ingested items get DATETIME_OLDEST as placeholder
+    return value is not None and value > CONSTANTS.DATETIME_OLDEST
+
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    seconds = GRANULARITIES[granularity]
+    return datetime.fromtimestamp(value.timestamp() // seconds * seconds)
+
+
+def aggregate(rows: Iterable[dict]) -> Dict[tuple, List[int]]:
+    """
+    Rollup key -> [files, bytes, duration_ms_sum] of items (dicts of `ITEM_COLUMNS`).
+    Items are bucketed by completion time, falling back to their last update.
+    """
+    now = datetime.now()
+    counters = OrderedDict()
+    for row in rows:
+        started = _as_datetime(row.get("transfer_started_on"))
+        completed = _as_datetime(row.get("transfer_completed_on"))
+        duration_ms = None
+        if _is_set(started) and _is_set(completed) and completed >= started:
+            duration_ms = int((completed - started).total_seconds() * 1000)
+        done_at = completed if _is_set(completed) else None
+        done_at = done_at or _as_datetime(row.get("updated_on")) or now
+        for granularity in GRANULARITIES:
+            key = (
+                granularity,
+                bucket_start(done_at, granularity),
+                row.get("source_storage_id") or "",
+                row.get("dest_storage_id") or "",
+                row["transfer_status"],
+                duration_bin(duration_ms),
+            )
+            counter = counters.setdefault(key, [0, 0, 0])
+            counter[0] += 1
+            counter[1] += int(row.get("content_length") or 0)
+            counter[2] += duration_ms or 0
+    return counters
+
+
+def record(conn, rows: Iterable[dict]) -> int:
+    """
+    Add done items to the rollups (an upsert incrementing the counters).
+    Returns the number of rollup rows touched.
+    """
+    counters = aggregate(rows)
+    if not counters:
+        return 0
+    values = [
+        dict(zip(ROLLUP_KEY + ROLLUP_COUNTERS, key + tuple(counter)))
+        for key, counter in counters.items()
+    ]
+    dialect = conn.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = insert(ROLLUP_TABLE)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEY),
+            set_={
+                counter: ROLLUP_TABLE.c[counter] + statement.excluded[counter]
+                for counter in ROLLUP_COUNTERS
+            },
+        )
+        conn.execute(statement, values)
+        return len(values)
+
+    for value in values:
+        res = conn.execute(
+            update(ROLLUP_TABLE)
+            .where(*[ROLLUP_TABLE.c[column] == value[column] for column in ROLLUP_KEY])
+            .values(
+                {
+                    counter: ROLLUP_TABLE.c[counter] + value[counter]
+                    for counter in ROLLUP_COUNTERS
+                }
+            )
+        )
+        if not res.rowcount:
+            conn.execute(ROLLUP_TABLE.insert(), value)
+    return len(values)
+
+
+def transitioned(old_status: Optional[str], new_status: Optional[str]) -> bool:
+    return new_status in TERMINAL_STATUSES and old_status != new_status
+
+
+def record_updates(session, model, updates: Dict[str, dict]) -> int:
+    """
+    Roll up the items reaching COMPLETED/FAILED through a set-based update,
+    to be called before the update within the same transaction.
+    `updates` maps uuids to the values they're updated with.
+    """
+    if model is not CatalogueItem:
+        return 0
+    updates = {
+        uuid: data
+        for uuid, data in updates.items()
+        if data.get("transfer_status") in TERMINAL_STATUSES
+    }
+    if not updates:
+        return 0
+    now = datetime.now()
+    rows = []
+    query = select(*[CatalogueItem.__table__.c[c] for c in ITEM_COLUMNS]).where(
+        CatalogueItem.uuid.in_(list(updates))
+    )
+    for row in session.execute(query):
+        row = dict(row._mapping)
+        data = updates[row["uuid"]]
+        if transitioned(row["transfer_status"], data["transfer_status"]):
+            rows.append({**row, **data, "updated_on": now})
+    return record(session.connection(), rows)
+
+
+@event.listens_for(Session, "before_flush")
+def _record_flushed_transitions(session, flush_context, instances) -> None:
+    """
+    Roll up the `CatalogueItem`s updated (or created) as COMPLETED/FAILED
+    through the ORM.
+    """
+    rows = []
+    for item in list(session.dirty) + list(session.new):
+        if not isinstance(item, CatalogueItem):
+            continue
+        state = inspect(item)
+        if state.pending:
+            old_status = None
+        else:
+            history = state.attrs.transfer_status.history
+            if not history.has_changes():
+                continue
+            old_status = history.deleted[0] if history.deleted else None
+        if transitioned(old_status, item.transfer_status):
+            rows.append({column: getattr(item, column) for column in ITEM_COLUMNS})
+    if rows:
+        record(session.connection(), rows)
+
+
+def percentile(histogram: Dict[int, int], total: int, pct: float) -> Optional[float]:
+    """
+    Duration (ms) percentile estimated from histogram bin counts,
+    interpolating linearly within the bin.
+    """
+    if not total:
+        return None
+    rank = pct / 100 * total
+    seen = 0
+    for duration_bin in sorted(histogram):
+        count = histogram[duration_bin]
+        if seen + count >= rank:
+            lower, upper = bin_bounds(duration_bin)
+            fraction = (rank - seen) / count if count else 0
+            return round(lower + (upper - lower) * fraction, 1)
+        seen += count
+    return round(bin_bounds(max(histogram))[1], 1)
+
+
+def throughput_series(
+    session,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    filters: Dict[str, List[str]],
+    percentiles: List[float],
+) -> List[dict]:
+    """
+    One series of buckets per storage pair and status, from the rollups
+    of [start, end). `filters` maps rollup key columns to accepted values.
+    """
+    query = (
+        select(CatalogueThroughputRollup)
+        .where(
+            CatalogueThroughputRollup.granularity == granularity,
+            CatalogueThroughputRollup.bucket_start >= bucket_start(start, granularity),
+            CatalogueThroughputRollup.bucket_start < end,
+        )
+        .order_by(
+            CatalogueThroughputRollup.source_storage_id,
+            CatalogueThroughputRollup.dest_storage_id,
+            CatalogueThroughputRollup.transfer_status,
+            CatalogueThroughputRollup.bucket_start,
+        )
+    )
+    for field, values in filters.items():
+        query = query.where(getattr(CatalogueThroughputRollup, field).in_(values))
+
+    # (source, dest, status) -> bucket_start -> aggregated bins
+    buckets = OrderedDict()
+    for rollup in session.execute(query).scalars():
+        series_key = (
+            rollup.source_storage_id,
+            rollup.dest_storage_id,
+            rollup.transfer_status,
+        )
+        bucket = buckets.setdefault(series_key, OrderedDict()).setdefault(
+            rollup.bucket_start,
+            dict(files=0, bytes=0, timed_files=0, duration_ms_sum=0, histogram={}),
+        )
+        bucket["files"] += rollup.files
+        bucket["bytes"] += rollup.bytes
+        if rollup.duration_bin != UNKNOWN_DURATION_BIN:
+            bucket["timed_files"] += rollup.files
+            bucket["duration_ms_sum"] += rollup.duration_ms_sum
+            bucket["histogram"][rollup.duration_bin] = rollup.files
+
+    seconds = GRANULARITIES[granularity]
+    series = []
+    for (source, dest, status), points in buckets.items():
+        series.append(
+            dict(
+                source_storage_id=source,
+                dest_storage_id=dest,
+                transfer_status=status,
+                points=[
+                    dict(
+                        bucket_start=start_.isoformat(),
+                        files=bucket["files"],
+                        bytes=bucket["bytes"],
+                        bytes_per_second=round(bucket["bytes"] / seconds, 1),
+                        timed_files=bucket["timed_files"],
+                        duration_ms=dict(
+                            mean=round(bucket["duration_ms_sum"] / bucket["timed_files"], 1)
+                            if bucket["timed_files"]
+                            else None,
+                            **{
+                                f"p{pct:g}": percentile(
+                                    bucket["histogram"], bucket["timed_files"], pct
+                                )
+                                for pct in percentiles
+                            },
+                        ),
+                    )
+                    for start_, bucket in points.items()
+                ],
+            )
+        )
+    return series
+
+
+def backfill(session, reset: bool = False) -> int:
+    """
+    Roll up the items already COMPLETED/FAILED of every shard (keyset
+    paginated on uuid), committing every chunk. With `reset` the rollups are
+    emptied first, otherwise it should only run once, on empty rollups.
+    """
+    if reset:
+        session.execute(delete(CatalogueThroughputRollup))
+        session.commit()
+    columns = [CatalogueItem.__table__.c[c] for c in ITEM_COLUMNS]
+    total = 0
+    for shard in shard_router.shards_for():
+        last_uuid = None
+        with shard_router.use(shard):
+            while True:
+                query = (
+                    select(*columns)
+                    .where(CatalogueItem.transfer_status.in_(TERMINAL_STATUSES))
+                    .order_by(CatalogueItem.uuid)
+                    .limit(BACKFILL_CHUNK_SIZE)
+                )
+                if last_uuid is not None:
+                    query = query.where(CatalogueItem.uuid > last_uuid)
+                rows = [dict(row._mapping) for row in session.execute(query)]
+                if not rows:
+                    break
+                record(session.connection(), rows)
+                session.commit()
+                total += len(rows)
+                last_uuid = rows[-1]["uuid"]
+                logger.debug(f"Backfilled {total} items")
+    logger.info(f"Backfilled the throughput rollups with {total} items")
+    return total
+
+
+def main():
+    from src.app import app, db
+
+    parser = argparse.ArgumentParser(description="Transfer throughput rollups.")
+    parser.add_argument("--backfill", action="store_true", required=True)
+    parser.add_argument(
+        "--reset", action="store_true", help="empty the rollups before the backfill"
+    )
+    args = parser.parse_args()
+
+    with app.app_context():
+        backfill(db.session, reset=args.reset)
+
+
+if __name__ == "__main__":
+    main()
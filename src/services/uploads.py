@@ -0,0 +1,148 @@
+"""
+Resumable chunked uploads of large manifests.
+
+    1. initiate: a directory `<root>/<upload_id>/` is created with a `meta.json`
+    2. chunks are PUT with their number (starting at 1) and stored as `<n>.part`,
+       re-sending a chunk overwrites it so a failed chunk can simply be retried
+    3. finalize: chunks are concatenated (hashing while streaming) into a single file
+
+Everything is kept on disk so an upload can be resumed after a restart.
+"""
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from itertools import islice
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from src.services.ingest import IngestError, copy_with_hash
+
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class LimitedReader:
+    """
+    Read at most `limit` bytes from a stream, raising once more is available.
+    """
+
+    def __init__(self, stream: BinaryIO, limit: int):
+        self.stream = stream
+        self.remaining = limit
+
+    def read(self, size: int = -1) -> bytes:
+        block = self.stream.read(size)
+        self.remaining -= len(block)
+        if self.remaining < 0:
+            raise IngestError("CHUNK_TOO_LARGE", "Chunk exceeds the maximum size!", 413)
+        return block
+
+
+class ChunkedUploads:
+    def __init__(self, root: str, max_chunk_bytes: int, expiry_seconds: int):
+        self.root = root
+        self.max_chunk_bytes = max_chunk_bytes
+        self.expiry_seconds = expiry_seconds
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, upload_id: str, *parts: str) -> str:
+        if not UPLOAD_ID_PATTERN.match(upload_id or ""):
+            raise IngestError("UPLOAD_NOT_FOUND", "Invalid upload id!", 404)
+        return os.path.join(self.root, upload_id, *parts)
+
+    def meta(self, upload_id: str) -> dict:
+        try:
+            with open(self._path(upload_id, "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise IngestError("UPLOAD_NOT_FOUND", "Upload doesn't exist!", 404)
+
+    def initiate(self, filename: str, extension: str) -> str:
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._path(upload_id))
+        with open(self._path(upload_id, "meta.json"), "w") as f:
+            json.dump(
+                dict(filename=filename, extension=extension, created=time.time()), f
+            )
+        return upload_id
+
+    def chunks(self, upload_id: str) -> List[int]:
+        self.meta(upload_id)
+        return sorted(
+            int(name.split(".")[0])
+            for name in os.listdir(self._path(upload_id))
+            if name.endswith(".part")
+        )
+
+    def write_chunk(
+        self,
+        upload_id: str,
+        number: int,
+        stream: BinaryIO,
+        expected_hash: Optional[str] = None,
+    ) -> dict:
+        """
+        Store a chunk, verifying its sha256 when `expected_hash` is given.
+        The chunk only becomes visible once fully written.
+        """
+        self.meta(upload_id)
+        if number < 1:
+            raise IngestError("INVALID_CHUNK", "Chunk numbers start at 1!")
+        path = self._path(upload_id, f"{number}.part")
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                content_hash, size = copy_with_hash(
+                    [LimitedReader(stream, self.max_chunk_bytes)], f
+                )
+            if expected_hash and expected_hash.lower() != content_hash:
+                raise IngestError("INVALID_CHUNK", "Chunk hash mismatch!")
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return dict(chunk=number, size=size, sha256=content_hash)
+
+    def assemble(self, upload_id: str, total_chunks: int) -> Tuple[str, str, int]:
+        """
+        Concatenate chunks 1..total_chunks into a single file.
+        Returns the file path, its sha256 and size.
+        """
+        meta = self.meta(upload_id)
+        received = set(self.chunks(upload_id))
+        # stops at the first 100 missing chunks, whatever total_chunks is
+        missing = list(
+            islice((n for n in range(1, total_chunks + 1) if n not in received), 100)
+        )
+        if total_chunks < 1 or missing:
+            raise IngestError("UPLOAD_INCOMPLETE", f"Missing chunks: {missing}", 409)
+        fpath = self._path(upload_id, f"assembled.{meta['extension']}")
+        with open(fpath, "wb") as f:
+            content_hash, size = copy_with_hash(self._open_chunks(upload_id, total_chunks), f)
+        return fpath, content_hash, size
+
+    def _open_chunks(self, upload_id: str, total_chunks: int) -> Iterator[BinaryIO]:
+        # one chunk open at a time, a large number of chunks can't exhaust the fds
+        for n in range(1, total_chunks + 1):
+            with open(self._path(upload_id, f"{n}.part"), "rb") as source:
+                yield source
+
+    def discard(self, upload_id: str) -> None:
+        shutil.rmtree(self._path(upload_id), ignore_errors=True)
+
+    def purge_expired(self) -> None:
+        now = time.time()
+        for upload_id in os.listdir(self.root):
+            if not UPLOAD_ID_PATTERN.match(upload_id):
+                continue
+            try:
+                created = self.meta(upload_id)["created"]
+            except (IngestError, ValueError, KeyError):
+                continue
+            if now - created > self.expiry_seconds:
+                logger.info(f"Removing expired upload={upload_id}")
+                self.discard(upload_id)
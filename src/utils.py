@@ -19,7 +19,7 @@ def clean_files(paths: List[str]) -> bool:
             logger.warning(f"Failed to remove path={path}")
 
 
-def abort_json(status_code, error="", message="", status="fail"):
+def abort_json(status_code, error="", message="", status="fail", headers=None):
     response = jsonify(
         {
             "status": status,
@@ -34,6 +34,8 @@ def abort_json(status_code, error="", message="", status="fail"):
         )
     )
     response.status_code = status_code
+    if headers:
+        response.headers.update(headers)
     abort(response)
 
 
@@ -0,0 +1,65 @@
+"""
+PATCH of an invalid enum value with the compact schema (`DB_COMPACT_SCHEMA`).
+
+The config is read at import, so the environment is set before importing the app.
+"""
+import os
+import tempfile
+import uuid
+
+DB_DIR = tempfile.mkdtemp()
+os.environ["DB_URI"] = f"sqlite:///{os.path.join(DB_DIR, 'catalogue.db')}"
+os.environ["DB_COMPACT_SCHEMA"] = "true"
+os.environ.pop("DB_SHARD_URIS", None)
+os.environ.pop("DB_REPLICA_URIS", None)
+os.environ.pop("GROUP_COMMIT_ENABLED", None)
+
+import pytest  # noqa: E402
+
+from src.app import app  # noqa: E402
+
+ITEM = dict(
+    source_path="source/a.txt",
+    destination_path="destination/a.txt",
+    checksum_algorithm="MD5",
+    checksum_value="x",
+    sealed_state="SEALED",
+    source_storage_id="source",
+    dest_storage_id="destination",
+)
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def create(client) -> str:
+    item_id = str(uuid.uuid4())
+    response = client.post("/catalogue/bulk/json/", json=[dict(ITEM, uuid=item_id)])
+    assert response.json["created"] == 1
+    return item_id
+
+
+def test_patch_unknown_status(client):
+    item_id = create(client)
+
+    response = client.patch(f"/catalogue/{item_id}/", json=dict(transfer_status="DONE"))
+    assert response.status_code == 400
+
+    response = client.patch(f"/catalogue/{item_id}/", json=dict(transfer_status="completed"))
+    assert response.status_code == 200
+    assert response.json["transfer_status"] == "COMPLETED"
+
+
+def test_bulk_patch_unknown_status(client):
+    first, second = create(client), create(client)
+
+    response = client.patch(
+        "/catalogue/bulk/",
+        json={first: dict(sealed_state="DONE"), second: dict(transfer_status="COMPLETED")},
+    )
+    assert response.status_code == 200
+    assert response.json["failed"] == [first]
+    assert response.json["success"] == [second]
+    assert client.get(f"/catalogue/{second}/").json["transfer_status"] == "COMPLETED"